@@ -1,13 +1,56 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from typing import List
+import asyncio
+import contextlib
+import functools
+import json
 import os
-import tempfile
-from pipelines.analyzer import analyze_certificate
+import zipfile
+from pipelines.ingest import MAX_UPLOAD_BYTES, RequestSizeLimit, UploadRejected, ingest_bytes, ingest_upload
+from pipelines.known_documents import index_generation
+from pipelines import deadline, metrics, warmup
+from pipelines.tasks import analyze_certificate, extract_identity, register_known_document
+from pipelines.token_verification import get_verifier
+from pipelines.result_cache import ResultCache, result_key
+from pipelines.template_store import build_template, default_store
+from pipelines.worker_pool import AnalysisPool, PoolSaturated
 
 
-app = FastAPI(title="Certificate Forgery Detection API")
+template_store = default_store()
+analysis_pool = AnalysisPool(initializer=warmup.warm_up)
+result_cache = ResultCache()
+
+# Certificates from one batch being analysed at the same time
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(analysis_pool.max_workers)))
+# Largest single certificate accepted from inside a batch zip archive
+MAX_BATCH_MEMBER_BYTES = int(os.environ.get("MAX_BATCH_MEMBER_BYTES", str(MAX_UPLOAD_BYTES)))
+
+
+async def _warm_up(app):
+    # Preload on a thread so the loop answers /health meanwhile, and finish it before the
+    # pool's workers fork from this process: a fork while another thread is half-way
+    # through an import can deadlock the child
+    await asyncio.to_thread(warmup.preload)
+    try:
+        app.state.worker_warm_up = await analysis_pool.start(warmup.status)
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Warm-up runs in the background, so /health answers at once; /ready reports when it is done
+    app.state.warm_up = asyncio.create_task(_warm_up(app))
+    try:
+        yield
+    finally:
+        app.state.warm_up.cancel()
+        analysis_pool.shutdown()
+        result_cache.close()
+
+
+app = FastAPI(title="Certificate Forgery Detection API", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -17,31 +60,251 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Refuses oversized bodies before they are spooled
+app.add_middleware(RequestSizeLimit)
+
+async def _warmed_up():
+    # No worker may fork while the preload thread is still importing
+    await asyncio.shield(app.state.warm_up)
+
+async def _run_in_pool(fn, *args, **kwargs):
+    await _warmed_up()
+    try:
+        return await analysis_pool.run(fn, *args, **kwargs)
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy analysing other certificates, please retry shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+async def _cached(endpoint, key, fn, *args, queued=False, deadline_at=None, **kwargs):
+    """
+    Return (result, "hit" | "miss", stage timings in ms); fn only runs in
+    the pool on a miss, and timings are empty on a hit.
+    With deadline_at (epoch seconds, see pipelines.deadline) fn runs under
+    that deadline and its result lists the checks it had to skip.
+    Failed analyses, extractions that found nothing and partial results
+    are not cached. Cache reads and writes run on a thread, since SQLite
+    may wait on another worker's lock.
+    """
+    result = await asyncio.to_thread(result_cache.get, key)
+    if result is not None:
+        metrics.count(metrics.REQUESTS, endpoint, "hit")
+        return dict(result), "hit", {}
+    # Metrics recorded in the worker come back as events and are replayed here
+    call = (metrics.traced_call, deadline.call_with_deadline, deadline_at, fn, *args)
+    if queued:
+        await _warmed_up()
+        result, events = await analysis_pool.run_queued(*call, **kwargs)
+    else:
+        result, events = await _run_in_pool(*call, **kwargs)
+    metrics.replay(events)
+    metrics.count(metrics.REQUESTS, endpoint, "miss")
+    if result.get("status") != "error" and result.get("success") is not False and not result.get("skipped_checks"):
+        await asyncio.to_thread(result_cache.put, key, result)
+    return dict(result), "miss", metrics.stage_timings(events)
+
+def _server_timing(timings):
+    return ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+
+async def _ingest(upload):
+    """Stream and validate an upload; see pipelines.ingest. The caller closes the result."""
+    try:
+        return await ingest_upload(upload)
+    except UploadRejected as e:
+        metrics.count(metrics.ERRORS, "ingest")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def _register_reference(upload):
+    ref = await _ingest(upload)
+    try:
+        template = template_store.get(ref.hexdigest)
+        if template is None:
+            metrics.count(metrics.BYTES_PROCESSED, "templates", amount=ref.size)
+            template, events = await _run_in_pool(metrics.traced_call, build_template, ref.source(), ref.hexdigest, upload.filename)
+            metrics.replay(events)
+            template_store.add(template)
+        return template
+    finally:
+        ref.close()
+
+async def _resolve_reference(reference_file, reference_id):
+    """Return (template, display name) for an uploaded reference or a registered one."""
+    if reference_file is not None:
+        template = await _register_reference(reference_file)
+        return template, reference_file.filename
+    if reference_id:
+        template = template_store.get(reference_id)
+        if template is None:
+            raise HTTPException(status_code=404, detail=f"Unknown reference template: {reference_id}")
+        return template, template["filename"]
+    raise HTTPException(status_code=400, detail="Provide either reference_file or reference_id.")
+
+@app.get("/health")
+async def health():
+    """Liveness check, plus the analysis pool's queue depth and utilisation."""
+    return {"status": "ok", "pool": analysis_pool.stats()}
+
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    Readiness check: 503 until warm-up has succeeded here and in every pool
+    worker. A warm-up step that failed keeps it at 503 ("failed"), with the
+    failed steps listed.
+    """
+    state = warmup.status()
+    workers = getattr(app.state, "worker_warm_up", None)
+    failed = warmup.failed_steps(state, *(workers or []))
+    if workers is None and app.state.warm_up.done():
+        failed.append("workers")
+    warm = state["preloaded"] and analysis_pool.started and workers is not None and not failed
+    if not warm:
+        response.status_code = 503
+    return {
+        "status": "ready" if warm else "failed" if failed else "warming",
+        "failed_steps": failed,
+        "warmup": state,
+        "workers": workers or [],
+        "pool": analysis_pool.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage durations, QR methods, OCR calls, bytes, errors and pool state in Prometheus text format."""
+    pool = analysis_pool.stats()
+    pool_metrics = {
+        "certificate_pool_running": ("gauge", "Analyses running in the worker pool.", pool["running"]),
+        "certificate_pool_queue_depth": ("gauge", "Analyses waiting for a worker.", pool["queue_depth"]),
+        "certificate_pool_rejected_total": ("counter", "Requests rejected because the pool was saturated.", pool["rejected"]),
+        "certificate_pool_failed_total": ("counter", "Pool jobs that raised.", pool["failed"]),
+    }
+    return PlainTextResponse(metrics.render_latest(pool_metrics), media_type="text/plain; version=0.0.4")
+
+@app.post("/templates")
+async def register_template(reference_file: UploadFile = File(...)):
+    """
+    Register a reference certificate once; later /analyze calls can pass the
+    returned template_id instead of uploading the reference again.
+    """
+    template = await _register_reference(reference_file)
+    return {
+        "template_id": template["id"],
+        "filename": template["filename"],
+        "extracted_data": template["extracted_data"],
+    }
+
+@app.post("/known-documents")
+async def add_known_document(
+    file: UploadFile = File(...),
+    label: str = Form(...),
+    reference_file: UploadFile = File(None),
+    reference_id: str = Form(None)
+):
+    """
+    Record a certificate as a known forgery or a verified original.
+
+    Later /analyze calls answer exact copies of it from the known-documents
+    index without running OCR or alignment. A forgery matches whatever the
+    reference; an original needs its reference, is analysed against it
+    once, and matches only that reference with the stored result.
+    Cached /analyze results from before the addition are not reused.
+    """
+    if label not in ("forged", "original"):
+        raise HTTPException(status_code=400, detail="label must be 'forged' or 'original'.")
+    template = None
+    if label == "original":
+        template, _ = await _resolve_reference(reference_file, reference_id)
+
+    upload = await _ingest(file)
+    try:
+        metrics.count(metrics.BYTES_PROCESSED, "known-documents", amount=upload.size)
+        result = None
+        if template is not None:
+            result = await _run_in_pool(analyze_certificate, upload.source(), reference_id=template["id"],
+                                        known_lookup=False)
+            if result.get("status") == "error":
+                raise HTTPException(status_code=400, detail=result["issues"][0])
+        record = await _run_in_pool(register_known_document, upload.source(), label, file.filename,
+                                    sha256=upload.hexdigest, reference_id=template and template["id"], result=result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        upload.close()
+    return record
+
+@app.post("/extract-data")
+async def extract_data(
+    response: Response,
+    file: UploadFile = File(...),
+    issuer: str = Form(None),
+    timings: bool = Form(False),
+    x_request_timeout_ms: int = Header(None)
+):
+    """
+    Extract the candidate name and QR token from a single certificate.
+    Returns name, token, token_hex, the verified claims when a JWT key is
+    configured, and the checks skipped to meet the request deadline.
+    """
+    deadline_at = deadline.expires_at(x_request_timeout_ms)
+    upload = await _ingest(file)
+    metrics.count(metrics.BYTES_PROCESSED, "extract-data", amount=upload.size)
+    key = result_key(None, "extract", options={"issuer": issuer}, digest=upload.digest)
+    try:
+        result, cache_status, stage_timings = await _cached("extract-data", key, extract_identity, upload.source(), file.filename, issuer,
+                                                            deadline_at=deadline_at)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        upload.close()
+    result["cache"] = cache_status
+    verifier = get_verifier()
+    if verifier.enabled and verifier.available:
+        # Outside the result cache, so expiry and key changes are always checked; on a
+        # thread, as a JWKS key fetch can block
+        result["verification"] = await asyncio.to_thread(verifier.check, result.get("token"), result.get("name"))
+    elif verifier.enabled:
+        # No PyJWT here: leave verification to the caller rather than fail every token
+        result["skipped_checks"] = result.get("skipped_checks", []) + ["token_verification"]
+    if timings:
+        result["stage_timings"] = stage_timings
+        response.headers["Server-Timing"] = _server_timing(stage_timings)
+    return result
 
 @app.post("/analyze", response_class=PlainTextResponse)
 async def analyze(
+    response: Response,
     test_file: UploadFile = File(...),
-    reference_file: UploadFile = File(...)
+    reference_file: UploadFile = File(None),
+    reference_id: str = Form(None),
+    timings: bool = Form(False),
+    x_request_timeout_ms: int = Header(None)
 ):
     """
     Endpoint to analyze a test certificate against a reference certificate.
     Returns a clean text report instead of raw JSON.
     """
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(test_file.filename)[1]) as tmp_test:
-        tmp_test.write(await test_file.read())
-        test_path = tmp_test.name
+    deadline_at = deadline.expires_at(x_request_timeout_ms)
+    template, reference_name = await _resolve_reference(reference_file, reference_id)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(reference_file.filename)[1]) as tmp_ref:
-        tmp_ref.write(await reference_file.read())
-        ref_path = tmp_ref.name
-
-    results = analyze_certificate(test_path, ref_path)
+    test_upload = await _ingest(test_file)
+    try:
+        metrics.count(metrics.BYTES_PROCESSED, "analyze", amount=test_upload.size)
+        key = result_key(None, "analyze", reference_id=template["id"],
+                         options={"known_documents": index_generation()}, digest=test_upload.digest)
+        results, cache_status, stage_timings = await _cached("analyze", key, analyze_certificate, test_upload.source(),
+                                                             deadline_at=deadline_at, reference_id=template["id"])
+    finally:
+        test_upload.close()
+    response.headers["X-Cache"] = cache_status
+    if timings:
+        response.headers["Server-Timing"] = _server_timing(stage_timings)
 
 
     report_lines = [
         "===== CERTIFICATE ANALYSIS REPORT =====\n",
         f"Test File: {test_file.filename}",
-        f"Reference File: {reference_file.filename}\n",
+        f"Reference File: {reference_name}\n",
         f"🔹 Validity Score: {results.get('validity_score', 'N/A')} / 100\n",
         "===== Detailed Analysis ====="
     ]
@@ -55,6 +318,11 @@ async def analyze(
     else:
         report_lines.append("No major issues found.")
     
+    known = results.get("known_document")
+    if known:
+        name = known.get("filename") or "without a file name"
+        report_lines.append(f"\nMatched a known {known['label']} certificate ({name}); full analysis skipped.")
+
     report_lines.append("\n===== Extracted Data (from Test Certificate) =====")
     extracted_data = results.get("extracted_data", {})
     if extracted_data:
@@ -66,12 +334,129 @@ async def analyze(
     forged_areas = results.get("forged_areas", [])
     if forged_areas:
         report_lines.append("\n===== Potential Forged Areas =====")
-        report_lines.append(f"Found {len(forged_areas)} areas with potential misalignment.")
+        tampered = sum(1 for area in forged_areas if area[0] == "tampered_region")
+        if tampered < len(forged_areas):
+            report_lines.append(f"Found {len(forged_areas) - tampered} areas with potential misalignment.")
+        if tampered:
+            report_lines.append(f"Found {tampered} regions with pixel-level changes.")
         
+    skipped = results.get("skipped_checks")
+    if skipped:
+        report_lines.append("\n===== Skipped Checks =====")
+        report_lines.append(f"Not run, to answer in time: {', '.join(skipped)}")
+
+    report_lines.append(f"\nCache: {cache_status}")
 
-    os.remove(test_path)
-    os.remove(ref_path)
+    if timings:
+        report_lines.append("\n===== Stage Timings (ms) =====")
+        if stage_timings:
+            for stage, ms in stage_timings.items():
+                report_lines.append(f"{stage}: {ms}")
+        else:
+            report_lines.append("Served from cache, no stages ran.")
 
     return "\n".join(report_lines)
 
 
+def _batch_items(test_files, archive):
+    """Yield (file name, async loader) pairs so each certificate is read only when its turn comes."""
+    for upload in test_files:
+        yield upload.filename, functools.partial(ingest_upload, upload)
+
+    if archive is not None:
+        for info in archive.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            if info.file_size > MAX_BATCH_MEMBER_BYTES:
+                yield info.filename, None
+                continue
+            yield info.filename, _zip_member_loader(archive, info)
+
+def _zip_member_loader(archive, info):
+    def read():
+        return ingest_bytes(archive.read(info), info.filename, max_bytes=MAX_BATCH_MEMBER_BYTES)
+
+    async def load():
+        # Decompressing and opening the PDF are blocking; keep them off the loop
+        return await asyncio.to_thread(read)
+    return load
+
+async def _analyze_batch_item(index, name, load, template):
+    line = {"index": index, "file": name}
+    if load is None:
+        line.update(status="error", issues=[f"File exceeds {MAX_BATCH_MEMBER_BYTES} bytes"])
+        return line
+    upload = None
+    try:
+        upload = await load()
+        metrics.count(metrics.BYTES_PROCESSED, "analyze/batch", amount=upload.size)
+        key = result_key(None, "analyze", reference_id=template["id"],
+                         options={"known_documents": index_generation()}, digest=upload.digest)
+        result, line["cache"], _ = await _cached("analyze/batch", key, analyze_certificate, upload.source(), queued=True,
+                                                 deadline_at=deadline.expires_at(), reference_id=template["id"])
+        line.update(result)
+    except UploadRejected as e:
+        metrics.count(metrics.ERRORS, "ingest")
+        line.update(status="error", validity_score=0, issues=[e.detail])
+    except Exception as e:
+        metrics.count(metrics.ERRORS, "batch")
+        line.update(status="error", validity_score=0, issues=[f"Error during analysis: {str(e)}"])
+    finally:
+        if upload is not None:
+            upload.close()
+    return line
+
+async def _stream_batch(items, template):
+    """Analyse items with at most BATCH_CONCURRENCY in flight, yielding NDJSON lines as they finish."""
+    pending = set()
+    try:
+        for index, (name, load) in enumerate(items):
+            while len(pending) >= BATCH_CONCURRENCY:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield json.dumps(task.result()) + "\n"
+            pending.add(asyncio.ensure_future(_analyze_batch_item(index, name, load, template)))
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+    finally:
+        # Client went away or the stream failed: drop work that has not started yet
+        for task in pending:
+            task.cancel()
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    test_files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    reference_file: UploadFile = File(None),
+    reference_id: str = Form(None)
+):
+    """
+    Analyze many test certificates against one reference.
+
+    Certificates come as repeated test_files parts and/or one zip archive.
+    The response is NDJSON: one line per certificate, in completion order,
+    carrying its index and file name next to the usual analysis result.
+    """
+    template, _ = await _resolve_reference(reference_file, reference_id)
+
+    zip_archive = None
+    if archive is not None:
+        try:
+            zip_archive = await asyncio.to_thread(zipfile.ZipFile, archive.file)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive is not a valid zip file.")
+
+    if not test_files and zip_archive is None:
+        raise HTTPException(status_code=400, detail="Provide test_files and/or an archive.")
+
+    items = _batch_items(test_files or [], zip_archive)
+    return StreamingResponse(_stream_batch(items, template), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    # python backend.py --workers 4: preload once, then fork the server processes
+    import serving
+    serving.main(app)
@@ -0,0 +1,249 @@
+"""
+Benchmark every pipeline stage over the bundled and synthetic certificates.
+
+Run from apps/server-2, recording the baseline on a commit that already
+has this harness (no baseline is checked in; earlier commits cannot run it):
+
+    python -m benchmarks.bench run --output baseline.json   # before the change
+    python -m benchmarks.bench run --output bench.json      # with the change
+    python -m benchmarks.bench compare bench.json baseline.json
+
+`run` writes per-stage p50/p95 timings and peak RSS as JSON. `compare`
+prints the change against a stored baseline and exits non-zero when any
+stage regressed by more than --threshold.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+
+import cv2
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+# Fresh caches and index, so every repeat measures real work rather than cache
+# hits. The pipelines read these paths when first imported, so set them first.
+CACHE_DIR = tempfile.mkdtemp(prefix="certificate-bench-")
+atexit.register(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+os.environ["TEMPLATE_CACHE_DIR"] = os.path.join(CACHE_DIR, "templates")
+os.environ["RESULT_CACHE_PATH"] = os.path.join(CACHE_DIR, "results.sqlite3")
+os.environ["RESULT_CACHE_TTL"] = "0"
+os.environ["KNOWN_DOCUMENTS_PATH"] = os.path.join(CACHE_DIR, "known_documents.jsonl")
+
+from benchmarks.workloads import REFERENCE_PDF, fixture_documents, synthetic_documents  # noqa: E402
+from pipelines.alignment_analysis import compare_alignment  # noqa: E402
+from pipelines.data_extraction import extract_certificate_data  # noqa: E402
+from pipelines.ocr_module import ocr_with_boxes  # noqa: E402
+from pipelines.preprocessing import load_certificate  # noqa: E402
+from pipelines.result_cache import PIPELINE_VERSION  # noqa: E402
+from pipelines.tamper_detection import detect_tampering, prepare_reference  # noqa: E402
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class Recorder:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.samples = {}
+        self.rss = {}
+        self.errors = {}
+
+    def measure(self, key, fn):
+        """Time fn `repeat` times under key; returns its last result, or None if it failed."""
+        result = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                self.errors[key] = f"{type(e).__name__}: {e}"
+                return None
+            self.samples.setdefault(key, []).append((time.perf_counter() - started) * 1000)
+        self.rss[key] = round(peak_rss_mb(), 1)
+        return result
+
+    def summary(self):
+        stages = {}
+        for key, samples in sorted(self.samples.items()):
+            stages[key] = {
+                "n": len(samples),
+                "p50_ms": round(percentile(samples, 50), 3),
+                "p95_ms": round(percentile(samples, 95), 3),
+                "mean_ms": round(statistics.fmean(samples), 3),
+                "peak_rss_mb": self.rss.get(key),
+            }
+        return stages
+
+
+def bench_document(rec, name, data, ref_words, ref_tamper, client, reference_id):
+    from qr_scan import CertificateAnalyzer
+
+    words, page_img = rec.measure(f"{name}/load_certificate", lambda: load_certificate(data)) or (None, None)
+    if words is None and page_img is not None:
+        words = rec.measure(f"{name}/ocr_with_boxes", lambda: ocr_with_boxes(page_img))
+    if words is not None:
+        rec.measure(f"{name}/extract_certificate_data", lambda: extract_certificate_data(words))
+        rec.measure(f"{name}/compare_alignment", lambda: compare_alignment(ref_words, words))
+    rec.measure(f"{name}/detect_tampering", lambda: detect_tampering(ref_tamper, data))
+
+    def qr_render():
+        analyzer = CertificateAnalyzer(data)
+        try:
+            if not analyzer.load_image():
+                raise ValueError("could not load document")
+        finally:
+            analyzer.close()
+
+    rec.measure(f"{name}/qr_render", qr_render)
+    # Decode on an already rendered page so rendering is not counted twice
+    analyzer = CertificateAnalyzer(data)
+    if analyzer.load_image():
+        rec.measure(f"{name}/qr_decode", analyzer.find_and_decode_qr)
+    analyzer.close()
+
+    if client is not None:
+        def analyze_endpoint():
+            response = client.post(
+                "/analyze",
+                files={"test_file": (os.path.basename(name), data)},
+                data={"reference_id": reference_id},
+            )
+            response.raise_for_status()
+        rec.measure(f"{name}/analyze_endpoint", analyze_endpoint)
+
+
+def make_client():
+    # Caches and index live under CACHE_DIR (see the top of this module)
+    from fastapi.testclient import TestClient
+    import backend
+    return TestClient(backend.app)
+
+
+def run(args):
+    rec = Recorder(args.repeat)
+    documents = fixture_documents()
+    if not args.no_synthetic:
+        documents += synthetic_documents()
+
+    with open(REFERENCE_PDF, "rb") as f:
+        reference = f.read()
+    ref_words, _ = load_certificate(reference)
+    ref_tamper = prepare_reference(reference)
+
+    client = reference_id = None
+    if not args.no_endpoint:
+        client = make_client()
+        client.__enter__()
+        response = client.post("/templates", files={"reference_file": ("WBJEE_RESULT.pdf", reference)})
+        response.raise_for_status()
+        reference_id = response.json()["template_id"]
+    try:
+        for name, data in documents:
+            print(f"benchmarking {name} ...", file=sys.stderr)
+            try:
+                bench_document(rec, name, data, ref_words, ref_tamper, client, reference_id)
+            except Exception:
+                rec.errors[name] = traceback.format_exc(limit=3)
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "pipeline_version": PIPELINE_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "repeat": args.repeat,
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": rec.summary(),
+        "errors": rec.errors,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(report['stages'])} stage results to {args.output}"
+          f" ({len(rec.errors)} errors, peak RSS {report['peak_rss_mb']} MB)", file=sys.stderr)
+    return 0
+
+
+def compare(args):
+    with open(args.current) as f:
+        current = json.load(f)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = 0
+    print(f"{'stage':<70} {'base p50':>10} {'p50':>10} {'base p95':>10} {'p95':>10}  change")
+    for key, now in sorted(current["stages"].items()):
+        base = baseline["stages"].get(key)
+        if base is None:
+            print(f"{key:<70} {'-':>10} {now['p50_ms']:>10.2f} {'-':>10} {now['p95_ms']:>10.2f}  new")
+            continue
+        flags = []
+        for metric in ("p50_ms", "p95_ms"):
+            delta = now[metric] - base[metric]
+            if delta > args.min_ms and now[metric] > base[metric] * (1 + args.threshold):
+                flags.append(metric.split("_")[0])
+        change = (now["p50_ms"] / base["p50_ms"] - 1) * 100 if base["p50_ms"] else 0.0
+        status = f"{change:+.1f}%" + (f"  REGRESSION ({', '.join(flags)})" if flags else "")
+        regressions += bool(flags)
+        print(f"{key:<70} {base['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} "
+              f"{base['p95_ms']:>10.2f} {now['p95_ms']:>10.2f}  {status}")
+
+    base_rss, now_rss = baseline.get("peak_rss_mb"), current.get("peak_rss_mb")
+    if base_rss and now_rss:
+        print(f"\npeak RSS: {base_rss} MB -> {now_rss} MB")
+        if now_rss > base_rss * (1 + args.threshold):
+            print("REGRESSION: peak RSS")
+            regressions += 1
+
+    print(f"\n{regressions} regression(s) at threshold {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="benchmark all stages and write a JSON report")
+    run_parser.add_argument("--output", default="bench.json")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--no-synthetic", action="store_true", help="only the bundled certificates")
+    run_parser.add_argument("--no-endpoint", action="store_true", help="skip end-to-end /analyze")
+
+    cmp_parser = sub.add_parser("compare", help="compare a report against a baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("--threshold", type=float, default=0.15, help="allowed relative slowdown")
+    cmp_parser.add_argument("--min-ms", type=float, default=2.0, help="ignore slowdowns smaller than this")
+
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Benchmark inputs: the bundled certificates plus synthetic, scaled-up variants."""
+import glob
+import os
+import random
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from pipelines.rendering import render_page
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENTS_DIR = os.path.join(APP_DIR, "components")
+REFERENCE_PDF = os.path.join(COMPONENTS_DIR, "original", "WBJEE_RESULT.pdf")
+
+
+def fixture_documents():
+    """(name, bytes) for every certificate bundled under components/."""
+    paths = sorted(glob.glob(os.path.join(COMPONENTS_DIR, "**", "*.pdf"), recursive=True))
+    paths += sorted(glob.glob(os.path.join(COMPONENTS_DIR, "**", "*.png"), recursive=True))
+    docs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            docs.append((os.path.relpath(path, COMPONENTS_DIR), f.read()))
+    return docs
+
+
+def multi_page(data, pages=10):
+    """The given PDF repeated to a document of `pages` pages."""
+    src = fitz.open(stream=data, filetype="pdf")
+    out = fitz.open()
+    while len(out) < pages:
+        out.insert_pdf(src, from_page=0, to_page=min(len(src), pages - len(out)) - 1)
+    return out.tobytes()
+
+
+def dense_text(words=5000, seed=0):
+    """An A4 page packed with small words, many of them repeated (like a mark sheet)."""
+    rng = random.Random(seed)
+    vocab = ["the", "of", "and", "marks", "total", "pass"] + [str(n) for n in range(100)]
+    vocab += ["".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(rng.randint(3, 9))) for _ in range(400)]
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    x, y = 20.0, 20.0
+    for _ in range(words):
+        word = rng.choice(vocab)
+        width = fitz.get_text_length(word, fontsize=5) + 3
+        if x + width > 575:
+            x, y = 20.0, y + 6.5
+        if y > 825:
+            break
+        page.insert_text((x, y), word, fontsize=5)
+        x += width
+    return doc.tobytes()
+
+
+def rotated_scan(data, angle=3.0, dpi=200, seed=0):
+    """First page rasterised, slightly rotated and noised like a phone scan, as PNG bytes."""
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        img = render_page(doc[0], dpi=dpi)
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    img = cv2.warpAffine(img, matrix, (w, h), borderValue=(255, 255, 255))
+    noise = np.random.default_rng(seed).normal(0, 8, img.shape)
+    img = np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    ok, png = cv2.imencode(".png", img)
+    return png.tobytes()
+
+
+def synthetic_documents(base_pdf=REFERENCE_PDF):
+    """(name, bytes) for the scaled workloads derived from one bundled PDF."""
+    with open(base_pdf, "rb") as f:
+        base = f.read()
+    return [
+        ("synthetic/multi_page_10.pdf", multi_page(base, 10)),
+        ("synthetic/dense_text_5000.pdf", dense_text(5000)),
+        ("synthetic/rotated_scan_3deg.png", rotated_scan(base, 3.0)),
+        ("synthetic/rotated_scan_-7deg.png", rotated_scan(base, -7.0)),
+    ]
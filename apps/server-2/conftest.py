@@ -0,0 +1 @@
+# Lets pytest import the pipelines package when run from anywhere in the repo
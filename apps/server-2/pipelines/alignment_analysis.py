@@ -1,14 +1,204 @@
+import numpy as np
+from pipelines.word_table import WordTable
+
+# Bits reserved for each grid coordinate inside a packed (token, cell_x, cell_y) key
+_CELL_BITS = 21
+_NEIGHBOUR_OFFSETS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def _centres(boxes):
+    return boxes[:, :2] + boxes[:, 2:] / 2.0
+
+
+def estimate_page_transform(ref_xy, test_xy, tolerance=10, min_anchors=3):
+    """
+    Fit test ≈ scale * ref + offset per axis from matched anchor points.
+
+    Uses least squares with two rounds of outlier rejection, so a handful of
+    moved words does not drag the fit. Returns (scale, offset) as length-2
+    arrays; identity when there are too few anchors or the fit is implausible.
+    """
+    scale, offset = np.ones(2), np.zeros(2)
+    if len(ref_xy) < min_anchors:
+        return scale, offset
+
+    for axis in range(2):
+        src, dst = ref_xy[:, axis], test_xy[:, axis]
+        keep = np.ones(len(src), dtype=bool)
+        for _ in range(3):
+            if keep.sum() < min_anchors or np.ptp(src[keep]) == 0:
+                break
+            a, b = np.polyfit(src[keep], dst[keep], 1)
+            residuals = np.abs(dst - (a * src + b))
+            mad = np.median(residuals[keep])
+            keep = residuals <= max(3 * 1.4826 * mad, tolerance / 2)
+            scale[axis], offset[axis] = a, b
+
+    if np.any(scale < 0.5) or np.any(scale > 2.0):
+        return np.ones(2), np.zeros(2)
+    return scale, offset
+
+
+def _anchor_pairs(ref_ids, test_ids):
+    """Indices of tokens that occur exactly once in both documents."""
+    ref_unique, ref_first, ref_counts = np.unique(ref_ids, return_index=True, return_counts=True)
+    test_unique, test_first, test_counts = np.unique(test_ids, return_index=True, return_counts=True)
+    common, ri, ti = np.intersect1d(ref_unique, test_unique, assume_unique=True, return_indices=True)
+    single = (ref_counts[ri] == 1) & (test_counts[ti] == 1)
+    return ref_first[ri[single]], test_first[ti[single]]
+
+
+class GridIndex:
+    """
+    Uniform grid over word centres, bucketed by token.
+
+    Points are stored under a packed (token, cell_x, cell_y) key and kept
+    sorted, so looking up every query's 3x3 neighbourhood is a handful of
+    vectorized searchsorted calls rather than a Python loop per word.
+    """
+
+    def __init__(self, tokens, points, cell_size, origin):
+        self.cell_size = float(cell_size)
+        self.origin = origin
+        keys = self._keys(tokens, self._cells(points))
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def _cells(self, points):
+        # +1 so the -1 neighbour of the first cell is still non-negative
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64) + 1
+
+    @staticmethod
+    def _keys(tokens, cells):
+        return (tokens.astype(np.int64) << (2 * _CELL_BITS)) | (cells[:, 0] << _CELL_BITS) | cells[:, 1]
+
+    def candidate_pairs(self, tokens, points):
+        """Return (query_idx, point_idx) for every same-token point in a query's neighbourhood."""
+        cells = self._cells(points)
+        query_parts, point_parts = [], []
+        for dx, dy in _NEIGHBOUR_OFFSETS:
+            keys = self._keys(tokens, cells + np.array([dx, dy]))
+            lo = np.searchsorted(self._sorted_keys, keys, side="left")
+            hi = np.searchsorted(self._sorted_keys, keys, side="right")
+            counts = hi - lo
+            if not counts.any():
+                continue
+            query_idx = np.repeat(np.arange(len(keys)), counts)
+            # Position of each expanded pair within its [lo, hi) run
+            run_pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            query_parts.append(query_idx)
+            point_parts.append(self._order[np.repeat(lo, counts) + run_pos])
+        if not query_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(query_parts), np.concatenate(point_parts)
+
+
+def _greedy_assign(ref_idx, test_idx, dist, ref_taken, test_taken):
+    """Accept candidate pairs closest-first, using every word at most once."""
+    pairs = []
+    for k in np.argsort(dist, kind="stable").tolist():
+        r, t = ref_idx[k], test_idx[k]
+        if not ref_taken[r] and not test_taken[t]:
+            ref_taken[r] = test_taken[t] = True
+            pairs.append((r, t))
+    return pairs
+
+
+def match_words(ref_words, test_words, tolerance=10):
+    """
+    Pair every reference word with its nearest same-text occurrence in the test.
+
+    Accepts WordTables or lists of word dicts. Repeated tokens ("the", "of",
+    digits) are matched occurrence by occurrence instead of collapsing to
+    one. Test positions are first mapped into the reference frame with
+    estimate_page_transform. Returns
+    (pairs, ref_boxes, aligned_test_boxes) where pairs is an (M, 2) array of
+    (ref_index, test_index).
+    """
+    ref_words, test_words = WordTable.from_records(ref_words), WordTable.from_records(test_words)
+    ref_boxes = ref_words.boxes.astype(np.float64)
+    test_boxes = test_words.boxes.astype(np.float64)
+    if not len(ref_words) or not len(test_words):
+        return np.empty((0, 2), dtype=np.int64), ref_boxes, test_boxes
+
+    vocab = {}
+    ref_ids = ref_words.encode(vocab)
+    test_ids = test_words.encode(vocab)
+
+    ref_xy, test_xy = _centres(ref_boxes), _centres(test_boxes)
+    anchor_ref, anchor_test = _anchor_pairs(ref_ids, test_ids)
+    scale, offset = estimate_page_transform(ref_xy[anchor_ref], test_xy[anchor_test], tolerance)
+
+    aligned = test_boxes.copy()
+    aligned[:, :2] = (test_boxes[:, :2] - offset) / scale
+    aligned[:, 2:] = test_boxes[:, 2:] / scale
+    aligned_xy = _centres(aligned)
+
+    median_height = float(np.median(ref_boxes[:, 3])) if len(ref_boxes) else 0.0
+    cell_size = max(4.0 * tolerance, 2.0 * median_height, 1.0)
+    origin = np.minimum(ref_xy.min(axis=0), aligned_xy.min(axis=0)) - cell_size
+    index = GridIndex(test_ids, aligned_xy, cell_size, origin)
+
+    ref_taken = np.zeros(len(ref_ids), dtype=bool)
+    test_taken = np.zeros(len(test_ids), dtype=bool)
+
+    # Nearby candidates first: this is where nearly all words pair up
+    cand_ref, cand_test = index.candidate_pairs(ref_ids, ref_xy)
+    dist = np.hypot(*(ref_xy[cand_ref] - aligned_xy[cand_test]).T)
+    pairs = _greedy_assign(cand_ref.tolist(), cand_test.tolist(), dist, ref_taken, test_taken)
+
+    # Words that moved further than a grid cell: nearest remaining occurrence anywhere
+    leftover = np.flatnonzero(~ref_taken & np.isin(ref_ids, test_ids[~test_taken]))
+    for token in np.unique(ref_ids[leftover]).tolist():
+        refs = leftover[ref_ids[leftover] == token]
+        tests = np.flatnonzero((test_ids == token) & ~test_taken)
+        if not len(tests):
+            continue
+        rr, tt = np.meshgrid(refs, tests, indexing="ij")
+        rr, tt = rr.ravel(), tt.ravel()
+        dist = np.hypot(*(ref_xy[rr] - aligned_xy[tt]).T)
+        pairs.extend(_greedy_assign(rr.tolist(), tt.tolist(), dist, ref_taken, test_taken))
+
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2), ref_boxes, aligned
+
+
 def compare_alignment(ref_words, test_words, tolerance=10):
     """Compare positions of key fields between reference and test certificates."""
+    ref_words, test_words = WordTable.from_records(ref_words), WordTable.from_records(test_words)
+    pairs, ref_boxes, aligned = match_words(ref_words, test_words, tolerance)
+    if not len(pairs):
+        return []
+
+    ref_idx, test_idx = pairs[:, 0], pairs[:, 1]
+    deltas = np.abs(ref_boxes[ref_idx, :2] - aligned[test_idx, :2])
+    misaligned = np.flatnonzero((deltas > tolerance).any(axis=1))
+
     forged_areas = []
-    ref_map = {w['text'].lower(): w['bbox'] for w in ref_words}
-    test_map = {w['text'].lower(): w['bbox'] for w in test_words}
-    
-    for word, ref_bbox in ref_map.items():
-        if word in test_map:
-            test_bbox = test_map[word]
-            dx = abs(ref_bbox[0] - test_bbox[0])
-            dy = abs(ref_bbox[1] - test_bbox[1])
-            if dx > tolerance or dy > tolerance:
-                forged_areas.append((word, ref_bbox, test_bbox))
+    for k in misaligned[np.argsort(ref_idx[misaligned])].tolist():
+        ref_word, test_word = ref_words[int(ref_idx[k])], test_words[int(test_idx[k])]
+        forged_areas.append((ref_word['text'].lower(), ref_word['bbox'], test_word['bbox']))
     return forged_areas
+
+
+def changed_word_boxes(ref_words, test_words, tolerance=10, pad=2):
+    """
+    Where the two documents' text differs, as (x0, y0, x1, y1) fractions of
+    the reference page: the reference words without a same-text partner in
+    the test, and the test words without one in the reference (mapped into
+    the reference frame), each grown by pad units. Empty when the
+    reference's page size is unknown.
+    """
+    ref_words, test_words = WordTable.from_records(ref_words), WordTable.from_records(test_words)
+    if ref_words.page_size is None:
+        return []
+    pairs, ref_boxes, aligned = match_words(ref_words, test_words, tolerance)
+    ref_unmatched = np.ones(len(ref_boxes), dtype=bool)
+    test_unmatched = np.ones(len(aligned), dtype=bool)
+    ref_unmatched[pairs[:, 0]] = False
+    test_unmatched[pairs[:, 1]] = False
+
+    boxes = np.concatenate([ref_boxes[ref_unmatched], aligned[test_unmatched]])
+    width, height = ref_words.page_size
+    corners = np.column_stack([boxes[:, :2] - pad, boxes[:, :2] + boxes[:, 2:] + pad])
+    fractions = corners / np.array([width, height, width, height], dtype=np.float64)
+    return [tuple(box) for box in np.clip(fractions, 0.0, 1.0).tolist()]
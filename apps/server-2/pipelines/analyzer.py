@@ -1,26 +1,121 @@
+import hashlib
+
 from pipelines.preprocessing import load_certificate
 from pipelines.ocr_module import ocr_with_boxes
 from pipelines.data_extraction import extract_certificate_data
-from pipelines.alignment_analysis import compare_alignment
+from pipelines.alignment_analysis import changed_word_boxes, compare_alignment
 from pipelines.scoring import compute_score
+from pipelines.tamper_detection import TAMPER_DETECTION, detect_tampering, prepare_reference
+from pipelines import deadline
+from pipelines.deadline import DeadlineExceeded
+from pipelines.known_documents import KNOWN_DOCUMENTS_LOOKUP, find_known
+from pipelines.template_store import default_store
+from pipelines.io_utils import read_source
+from pipelines.issuer_templates import detect_issuer
+from pipelines.word_table import WordTable
+from pipelines.parallel import submit
+from pipelines.metrics import ERRORS, KNOWN_DOCUMENTS, count, timed
+
+def process_document(source):
+    """Load a certificate (path, bytes or buffer) and return its word layout and extracted fields."""
+    words, page_img = load_certificate(source)
+    if words is None:
+        with timed("ocr"):
+            words = ocr_with_boxes(page_img)
+    with timed("extract_fields"):
+        return words, extract_certificate_data(words)
+
+# Fields that say whose certificate it is; a test agreeing with the reference
+# on any of them claims to be the reference's own certificate
+IDENTITY_FIELDS = ("name", "roll")
+
+def _same_certificate(ref_cert_data, test_cert_data):
+    for field in IDENTITY_FIELDS:
+        ref_value, test_value = ref_cert_data.get(field), test_cert_data.get(field)
+        if ref_value and test_value and " ".join(ref_value.split()).lower() == " ".join(test_value.split()).lower():
+            return True
+    return False
+
+def variable_regions(ref_words, ref_cert_data, test_words, test_cert_data):
+    """
+    Parts of the reference page, as (x0, y0, x1, y1) fractions, that the
+    pixel comparison should leave out. A test that claims to be the
+    reference's own certificate is compared everywhere. Otherwise the
+    reference only stands for its issuer's layout, so the issuer
+    template's field regions and the words whose text differs are left out.
+    """
+    if _same_certificate(ref_cert_data, test_cert_data):
+        return []
+    ref_words = WordTable.from_records(ref_words)
+    issuer = detect_issuer(ref_words.joined_text)
+    regions = [tuple(spec["box"]) for spec in issuer["regions"].values()] if issuer is not None else []
+    return regions + changed_word_boxes(ref_words, test_words)
+
+def _detect_tampering(reference, test_data, ignore):
+    with timed("tamper"):
+        return detect_tampering(reference, test_data, ignore=ignore)
+
+def analyze_certificate(test_file, reference_file=None, reference_template=None, reference_id=None,
+                        known_lookup=KNOWN_DOCUMENTS_LOOKUP):
+    """
+    Analyze a test certificate, optionally against a reference.
 
-def analyze_certificate(test_file, reference_file=None):
+    The reference is a path, bytes or buffer, a precomputed template (see
+    pipelines.template_store), or the reference_id of a stored template.
+    Copies of known documents are answered from pipelines.known_documents.
+    """
+    futures = []
     try:
         # Process test file
-        test_words, test_img_path = load_certificate(test_file)
-        if test_words is None:
-            test_words = ocr_with_boxes(test_img_path)
-        test_cert_data = extract_certificate_data(test_words)
+        test_data = read_source(test_file)
+        # Loaded here, so only the template's ID is sent to the pool worker
+        if reference_template is None and reference_id is not None:
+            reference_template = default_store().get(reference_id)
+            if reference_template is None:
+                raise ValueError(f"Unknown reference template: {reference_id}")
+        reference_id = (reference_template or {}).get("id")
+        if known_lookup:
+            with timed("known_documents"):
+                known = find_known(hashlib.sha256(test_data).hexdigest(), reference_id)
+            if known is not None:
+                count(KNOWN_DOCUMENTS, known["known_document"]["label"])
+                return known
+
+        ref_future = prepare_future = None
+        if reference_template is None and reference_file:
+            ref_data = read_source(reference_file)
+            ref_future = submit(process_document, ref_data)
+            futures.append(ref_future)
+            if TAMPER_DETECTION:
+                prepare_future = submit(prepare_reference, ref_data)
+                futures.append(prepare_future)
+
+        test_words, test_cert_data = process_document(test_data)
 
         forged_areas = []
         ref_cert_data = {}
 
-        if reference_file:
-            ref_words, ref_img_path = load_certificate(reference_file)
-            if ref_words is None:
-                ref_words = ocr_with_boxes(ref_img_path)
-            ref_cert_data = extract_certificate_data(ref_words)
-            forged_areas = compare_alignment(ref_words, test_words)
+        if ref_future is not None:
+            ref_words, ref_cert_data = ref_future.result()
+            reference_template = {
+                "words": ref_words,
+                "extracted_data": ref_cert_data,
+                "tamper": prepare_future.result() if prepare_future is not None else None,
+            }
+
+        if reference_template is not None:
+            ref_words = reference_template["words"]
+            ref_cert_data = reference_template["extracted_data"]
+            tamper_future = None
+            # Templates stored before pixel comparison existed have no render
+            if TAMPER_DETECTION and reference_template.get("tamper") is not None and deadline.allows("tamper"):
+                ignore = variable_regions(ref_words, ref_cert_data, test_words, test_cert_data)
+                tamper_future = submit(_detect_tampering, reference_template["tamper"], test_data, ignore)
+                futures.append(tamper_future)
+            with timed("alignment"):
+                forged_areas = compare_alignment(ref_words, test_words)
+            if tamper_future is not None:
+                forged_areas += deadline.wait(tamper_future, "tamper") or []
 
         # Score
         score, issues = compute_score(forged_areas)
@@ -33,9 +128,20 @@ def analyze_certificate(test_file, reference_file=None):
             "forged_areas": forged_areas
         }
 
+    except DeadlineExceeded as e:
+        return {
+            "status": "error",
+            "validity_score": 0,
+            "issues": [f"Analysis did not finish in time: {e}"]
+        }
     except Exception as e:
+        count(ERRORS, "analyze")
         return {
             "status": "error",
             "validity_score": 0,
             "issues": [f"Error during analysis: {str(e)}"]
         }
+    finally:
+        # Stages still queued when the analysis failed are not worth running
+        for future in futures:
+            future.cancel()
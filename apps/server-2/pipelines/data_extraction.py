@@ -1,20 +1,14 @@
-import re
+from pipelines.issuer_templates import extractor_for, get_issuer_template
+from pipelines.word_table import WordTable
 
-def extract_certificate_data(words):
-    """Map extracted words into structured certificate fields."""
-    text_content = " ".join([w['text'] for w in words])
-    
-    patterns = {
-        "name": r"Name[:\-]?\s*([A-Za-z\s]+)",
-        "dob": r"Date of Birth[:\-]?\s*([\d\-\/]+)",
-        "roll": r"Roll\s*No[:\-]?\s*([A-Za-z0-9]+)",
-        "degree": r"(Bachelor|Master|Diploma|Certificate)[A-Za-z\s]*",
-    }
-    
-    extracted = {}
-    for field, pattern in patterns.items():
-        match = re.search(pattern, text_content, re.IGNORECASE)
-        if match:
-            extracted[field] = match.group(1).strip()
-    
-    return extracted
+def extract_certificate_data(words, issuer=None):
+    """
+    Map extracted words (WordTable or list of word dicts) into structured certificate fields.
+
+    Fields come from the issuer layout's extraction rules (detected from the
+    text when issuer is not given) followed by the generic ones.
+    """
+    words = WordTable.from_records(words)
+    text_content = words.joined_text
+    extractor = extractor_for(get_issuer_template(issuer), text_content)
+    return extractor.extract(text_content, words)
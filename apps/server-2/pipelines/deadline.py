@@ -0,0 +1,130 @@
+import contextvars
+import os
+import time
+
+# Seconds a request may spend in the pipeline; the Node gateway gives up after 30
+REQUEST_BUDGET_SECONDS = float(os.environ.get("REQUEST_BUDGET_SECONDS", "25"))
+# Taken off a caller's own timeout (X-Request-Timeout-Ms) for the upload and the response
+RESPONSE_MARGIN_SECONDS = float(os.environ.get("DEADLINE_RESPONSE_MARGIN_SECONDS", "2"))
+# Optional fallbacks are skipped once less than this many seconds are left
+FALLBACK_RESERVE_SECONDS = float(os.environ.get("DEADLINE_FALLBACK_RESERVE_SECONDS", "3"))
+
+# Deadline of the request being processed, if any (see call_with_deadline)
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised by a stage that cannot start, or was stopped, because the request's time is up."""
+
+
+class Deadline:
+    """
+    Wall-clock time by which a request must be answered, and the checks
+    skipped to meet it.
+
+    Expiry is an epoch timestamp so it keeps its meaning in the pool worker
+    the request is handed to. Stage threads inherit it with the context
+    (see pipelines.parallel.submit).
+    """
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+        self.skipped = []
+
+    def remaining(self):
+        return self.expires_at - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def skip(self, check):
+        if check not in self.skipped:
+            self.skipped.append(check)
+
+
+def expires_at(timeout_ms=None):
+    """Epoch deadline for a request starting now, capped by the caller's own timeout if it sent one."""
+    budget = REQUEST_BUDGET_SECONDS
+    if timeout_ms:
+        budget = min(budget, timeout_ms / 1000.0 - RESPONSE_MARGIN_SECONDS)
+    return time.time() + max(budget, 0.0)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    """Seconds left for this request; None without a deadline."""
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def allows(check, cost=FALLBACK_RESERVE_SECONDS):
+    """
+    Whether an optional step expected to take about cost seconds still fits.
+    A step that does not fit is recorded as skipped under check.
+    """
+    deadline = _current.get()
+    if deadline is None or deadline.remaining() >= cost:
+        return True
+    deadline.skip(check)
+    return False
+
+
+def skipped():
+    """Checks skipped so far in this request."""
+    deadline = _current.get()
+    return list(deadline.skipped) if deadline is not None else []
+
+
+def skip(check):
+    """Record that check was skipped (or cut short) for lack of time."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.skip(check)
+
+
+def check(stage):
+    """Raise DeadlineExceeded, recording stage as skipped, if the request is out of time."""
+    deadline = _current.get()
+    if deadline is not None and deadline.expired():
+        deadline.skip(stage)
+        raise DeadlineExceeded(f"No time left for {stage}")
+
+
+def wait(future, check):
+    """
+    Result of a stage future, waiting no longer than the deadline allows.
+    On timeout the future is cancelled (if it has not started), check is
+    recorded as skipped and None is returned; a started stage stops at its
+    own next deadline check.
+    """
+    try:
+        return future.result(timeout=remaining())
+    except TimeoutError:
+        if not future.done():
+            future.cancel()
+            skip(check)
+            return None
+        return future.result()
+
+
+def call_with_deadline(deadline_at, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) under a deadline (epoch seconds, or None).
+
+    A dict result gets "skipped_checks": the optional checks that were
+    skipped or cut short to finish in time, empty when everything ran.
+    """
+    if deadline_at is None:
+        return fn(*args, **kwargs)
+    deadline = Deadline(deadline_at)
+    token = _current.set(deadline)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _current.reset(token)
+    if isinstance(result, dict):
+        result["skipped_checks"] = list(deadline.skipped)
+    return result
@@ -0,0 +1,166 @@
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from pipelines.io_utils import FITZ_LOCK, read_source, is_pdf, decode_image, open_pdf
+from pipelines.metrics import timed
+from pipelines.word_table import WordTable
+
+# Set TEXT_LAYER=0 to always render and OCR, ignoring embedded text
+TEXT_LAYER = os.environ.get("TEXT_LAYER", "1") != "0"
+# A text layer with fewer words than this is treated as missing
+MIN_TEXT_WORDS = int(os.environ.get("TEXT_LAYER_MIN_WORDS", "5"))
+# Share of characters that must be ordinary printable text; fonts without a
+# Unicode map come out as U+FFFD, control or private-use characters
+MIN_TEXT_QUALITY = float(os.environ.get("TEXT_LAYER_MIN_QUALITY", "0.9"))
+# Share of words that must contain a letter or digit
+MIN_ALNUM_WORDS = 0.6
+# An image covering this share of the page makes it a scan: its text layer
+# counts only if enough words lie on the image (a searchable scan), not just
+# a printed header or stamp around it
+SCAN_IMAGE_COVERAGE = 0.5
+# Words whose tops are this close (in points) are on the same line
+LINE_TOLERANCE = 3.0
+
+_BAD_CATEGORIES = {"Cc", "Cf", "Co", "Cs", "Cn"}
+
+
+def text_quality(texts):
+    """Share (0-1) of the characters in texts that are ordinary, readable text."""
+    total = bad = 0
+    for text in texts:
+        for ch in text:
+            total += 1
+            if ch == "\ufffd" or unicodedata.category(ch) in _BAD_CATEGORIES:
+                bad += 1
+    return 1.0 - bad / total if total else 0.0
+
+
+def _reading_order(boxes):
+    """Word indices top to bottom, then left to right within each line."""
+    by_top = np.argsort(boxes[:, 1], kind="stable")
+    line_ids = np.cumsum(np.diff(boxes[by_top, 1], prepend=boxes[by_top[0], 1]) > LINE_TOLERANCE)
+    return by_top[np.lexsort((boxes[by_top, 0], line_ids))]
+
+
+class TextLayer:
+    """
+    Words of one PDF page's embedded text, in PDF points, and whether they
+    are good enough to stand in for OCR.
+
+    words is a WordTable in reading order with the same (left, top, width,
+    height) boxes OCR produces for a 72 dpi render, so the text layer feeds
+    field extraction and alignment unchanged.
+    """
+
+    def __init__(self, words, width_pt, height_pt, problem=None):
+        self.words = words
+        self.width_pt = width_pt
+        self.height_pt = height_pt
+        self.problem = problem
+
+    @property
+    def usable(self):
+        return self.problem is None
+
+    @property
+    def text(self):
+        return self.words.joined_text
+
+    def region_text(self, template, field):
+        """
+        Text of a template field's region, read from the layer instead of
+        OCR'ing its crop; None when missing, empty or invalid (see
+        pipelines.issuer_templates.ocr_region).
+        """
+        spec = template.get("regions", {}).get(field)
+        if spec is None or not spec.get("ocr", True):
+            return None
+        x0, y0, x1, y1 = spec["box"]
+        region = self.words.region(x0 * self.width_pt, y0 * self.height_pt, x1 * self.width_pt, y1 * self.height_pt)
+        text = re.sub(r"\s+", " ", region.joined_text).strip()
+        validate = spec.get("validate_re")
+        if not text or (validate is not None and not validate.match(text)):
+            return None
+        return text
+
+    def regions(self, template, fields=None):
+        """{field: text} of every (or the given) valid template field; see region_text."""
+        results = {}
+        for field in template.get("regions", {}):
+            if fields is not None and field not in fields:
+                continue
+            text = self.region_text(template, field)
+            if text is not None:
+                results[field] = text
+        return results
+
+
+def read_text_layer(page):
+    """Read a fitz page's text layer and check it; see TextLayer.usable."""
+    with timed("pdf_words"):
+        with FITZ_LOCK:
+            entries = [w for w in page.get_text("words") if w[4].strip()]
+            width, height = page.rect.width, page.rect.height
+            images = page.get_image_info()
+        if not entries:
+            return TextLayer(WordTable.empty(), width, height, problem="no text layer")
+
+        coords = np.array([w[:4] for w in entries], dtype=np.float64)
+        boxes = np.column_stack([coords[:, :2], coords[:, 2:] - coords[:, :2]]).astype(np.int32)
+        order = _reading_order(boxes)
+        words = WordTable.from_columns([entries[i][4] for i in order.tolist()], boxes[order], [99.0] * len(entries),
+                                       page_size=(width, height))
+
+        texts = words.texts
+        problem = None
+        if len(words) < MIN_TEXT_WORDS:
+            problem = f"only {len(words)} words"
+        elif text_quality(texts) < MIN_TEXT_QUALITY:
+            problem = "unreadable characters"
+        elif sum(1 for t in texts if any(ch.isalnum() for ch in t)) < MIN_ALNUM_WORDS * len(texts):
+            problem = "mostly symbols"
+        else:
+            page_area = max(width * height, 1.0)
+            for image in images:
+                ix0, iy0, ix1, iy1 = image["bbox"]
+                if (ix1 - ix0) * (iy1 - iy0) < SCAN_IMAGE_COVERAGE * page_area:
+                    continue
+                if len(words.region(ix0, iy0, ix1, iy1)) < MIN_TEXT_WORDS:
+                    problem = "scanned page without searchable text"
+                    break
+        return TextLayer(words, width, height, problem)
+
+
+def usable_text_layer(page):
+    """The page's TextLayer if it can replace OCR (and TEXT_LAYER is on), else None."""
+    if not TEXT_LAYER or page is None:
+        return None
+    layer = read_text_layer(page)
+    return layer if layer.usable else None
+
+
+def iter_pages(source):
+    """
+    Yield (PagePyramid, TextLayer or None) for each page of a PDF or image.
+
+    The text layer is read first and is None when the page has to be
+    rendered and OCR'd; each resolution of a page is rendered at most once,
+    only when a stage asks for it, and shared by every stage that reads it.
+    """
+    from pipelines.rendering import PagePyramid
+
+    data = read_source(source)
+    if not is_pdf(data):
+        with timed("decode_image"):
+            image = decode_image(data)
+        yield PagePyramid(image=image), None
+        return
+    with open_pdf(data) as doc:
+        for number in range(doc.page_count):
+            with FITZ_LOCK:
+                page = doc[number]
+            yield PagePyramid(page=page), usable_text_layer(page)
+
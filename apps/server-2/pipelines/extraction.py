@@ -0,0 +1,69 @@
+import time
+
+from pipelines import deadline
+from pipelines.document import iter_pages
+from pipelines.io_utils import read_source
+from pipelines.parallel import submit
+from qr_scan import CertificateAnalyzer
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def extract_identity(source, filename=None, issuer=None):
+    """
+    Extract the candidate name and QR token from a certificate in one pass.
+
+    Pages are read in order, name OCR and QR decoding sharing each page's
+    renders, until both are found. Returns a dict with name, token,
+    token_hex, success and per-stage timings in milliseconds.
+    """
+    started = time.perf_counter()
+    data = read_source(source)
+    timings = {"render": 0.0, "name": 0.0, "qr": 0.0}
+    result = {
+        "name": None,
+        "token": None,
+        "token_hex": None,
+        "name_source": None,
+        "qr_method": None,
+        "pages_processed": 0,
+    }
+
+    pages = iter_pages(data)
+    while result["name"] is None or result["token_hex"] is None:
+        pyramid, text_layer = next(pages, (None, None))
+        if pyramid is None or (result["pages_processed"] and not deadline.allows("later_pages")):
+            break
+        result["pages_processed"] += 1
+
+        analyzer = CertificateAnalyzer(pyramid, filename, issuer, text_layer=text_layer)
+        _, elapsed = _timed(analyzer.load_image)
+        timings["render"] += elapsed
+        name_future = qr_future = None
+        if result["name"] is None:
+            name_future = submit(_timed, analyzer.extract_candidate_name)
+        if result["token_hex"] is None:
+            qr_future = submit(_timed, analyzer.find_and_decode_qr)
+
+        if name_future is not None:
+            name, elapsed = deadline.wait(name_future, "name") or (None, 0.0)
+            timings["name"] += elapsed
+            if name:
+                result["name"], result["name_source"] = name, analyzer.name_source
+        if qr_future is not None:
+            token_hex, elapsed = deadline.wait(qr_future, "qr") or (None, 0.0)
+            timings["qr"] += elapsed
+            if token_hex:
+                result["token_hex"], result["qr_method"] = token_hex, analyzer.qr_method
+                result["token"] = bytes.fromhex(token_hex).decode("utf-8", errors="replace")
+        # Done with this page: free its renders before the next one is made
+        pyramid.release()
+
+    result["success"] = bool(result["name"] or result["token_hex"])
+    timings["total"] = time.perf_counter() - started
+    result["timings"] = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+    return result
@@ -0,0 +1,188 @@
+import re
+
+import numpy as np
+
+# Generic rules used for every document; an issuer layout's own rules for a
+# field are tried before these. Within a field, earlier rules win.
+DEFAULT_RULES = {
+    "name": [
+        {"label": r"Name[:\-]?", "value": r"[A-Za-z\s]+"},
+    ],
+    "dob": [
+        {"label": r"Date of Birth[:\-]?", "value": r"[\d\-\/]+"},
+    ],
+    "roll": [
+        {"label": r"Roll\s*No[:\-]?", "value": r"[A-Za-z0-9]+"},
+    ],
+    "degree": [
+        {"value": r"Bachelor|Master|Diploma|Certificate", "suffix": r"[A-Za-z\s]*"},
+    ],
+}
+
+# Phrases that introduce the candidate's name, for the name search of the
+# QR verification flow (see qr_scan.CertificateAnalyzer.extract_candidate_name);
+# the document fields above keep their plain "Name:" rule
+CANDIDATE_NAME_RULES = [
+    {"label": r"certify that\s+", "value": r"[A-Za-z\s]+", "suffix": r"\s+has"},
+    {"label": r"Name[:\-]?", "value": r"[A-Za-z\s]+"},
+    {"label": r"awarded to\s+", "value": r"[A-Za-z\s]+", "suffix": r"\s+"},
+    {"label": r"presented to\s+", "value": r"[A-Za-z\s]+", "suffix": r"\s+"},
+    {"label": r"certify that\s+", "value": r"[A-Za-z\s]+"},
+]
+
+# Value words further apart than this many line heights end a positional field
+DEFAULT_MAX_GAP = 3.0
+
+_LITERAL_PREFIX = re.compile(r"[A-Za-z0-9 ]+")
+
+
+def _anchors(rule):
+    """
+    Lower-case literals one of which starts every match of a text rule, or
+    None when the rule's pattern does not begin with plain text.
+    """
+    source = rule.get("label") or rule["value"]
+    if "|" in source:
+        if "(" in source or "[" in source:
+            return None
+        alternatives = source.split("|")
+    else:
+        alternatives = [source]
+    anchors = []
+    for alternative in alternatives:
+        match = _LITERAL_PREFIX.match(alternative)
+        literal = match.group(0) if match else ""
+        if literal and alternative[len(literal):len(literal) + 1] in ("?", "*", "{"):
+            literal = literal[:-1]  # the last character is optional
+        literal = literal.strip()
+        if not literal:
+            return None
+        anchors.append(literal.lower())
+    return anchors
+
+
+class FieldExtractor:
+    """
+    Extracts the fields of one rule set (an issuer layout plus the generic
+    rules), compiled once when the set is loaded.
+
+    A text rule is a label regex, a value regex and an optional suffix
+    regex, matched case-insensitively. Each rule also gets the literal text
+    it must start with; one lower-cased copy of the document is searched for
+    those literals (shared between rules) before any regex runs, so rules
+    whose label does not occur cost a substring search and the others start
+    at their first possible position. Per field, rules are tried in order
+    and the first that matches wins, so later rules of a satisfied field
+    never run.
+
+    A positional rule ({"right_of": "Roll Number", "value": ...}) reads the
+    words on the same line to the right of a label in a WordTable, stopping
+    at a wide gap or at any of its "stop" words.
+    """
+
+    def __init__(self, rules):
+        self.rules = {field: list(field_rules) for field, field_rules in rules.items()}
+        for field_rules in self.rules.values():
+            for rule in field_rules:
+                if "right_of" in rule:
+                    rule["value_re"] = re.compile(rule["value"], re.IGNORECASE) if rule.get("value") else None
+                    rule["label_tokens"] = rule["right_of"].lower().split()
+                    rule["stop_words"] = {w.lower() for w in rule.get("stop", [])}
+                else:
+                    rule["regex"] = re.compile(
+                        f"{rule.get('label', '')}\\s*(?P<value>{rule['value']}){rule.get('suffix', '')}",
+                        re.IGNORECASE,
+                    )
+                    rule["anchors"] = _anchors(rule)
+
+    def _search(self, rule, text, lowered, first_seen):
+        start = 0
+        if rule["anchors"] is not None:
+            positions = []
+            for anchor in rule["anchors"]:
+                pos = first_seen.get(anchor)
+                if pos is None:
+                    pos = first_seen[anchor] = lowered.find(anchor)
+                if pos >= 0:
+                    positions.append(pos)
+            if not positions:
+                return None
+            # Lower-casing can change the length of some non-ASCII text
+            if len(lowered) == len(text):
+                start = min(positions)
+        match = rule["regex"].search(text, start)
+        return match.group("value") if match else None
+
+    def _right_of(self, rule, words):
+        label = rule["label_tokens"]
+        n = len(label)
+        keys = [v.lower().rstrip(":") for v in words.vocab]  # once per distinct word
+        first = [code for code, key in enumerate(keys) if key == label[0]]
+        for i in np.flatnonzero(np.isin(words.codes, first)).tolist():
+            if [keys[c] for c in words.codes[i:i + n].tolist()] != label:
+                continue
+            boxes = words.boxes[i:i + n]
+            top, bottom = boxes[:, 1].min(), (boxes[:, 1] + boxes[:, 3]).max()
+            right = (boxes[:, 0] + boxes[:, 2]).max()
+            height = max(bottom - top, 1)
+            centre = (top + bottom) / 2.0
+
+            c = words.centres
+            same_line = (abs(c[:, 1] - centre) <= height * 0.6) & (words.boxes[:, 0] >= right)
+            candidates = sorted(np.flatnonzero(same_line).tolist(), key=lambda j: words.boxes[j, 0])
+
+            value, last_right = [], None
+            for j in candidates:
+                x0, _, w, _ = words.boxes[j].tolist()
+                key = keys[words.codes[j]]
+                if key in rule["stop_words"]:
+                    break
+                if last_right is not None and x0 - last_right > rule.get("max_gap", DEFAULT_MAX_GAP) * height:
+                    break
+                value.append(words.vocab[words.codes[j]])
+                last_right = x0 + w
+            text = " ".join(value)
+            if rule["value_re"] is not None:
+                match = rule["value_re"].match(text)
+                text = match.group(0) if match else ""
+            if text.strip():
+                return text
+        return None
+
+    def extract(self, text, words=None, fields=None):
+        """
+        Return {field: value} for the wanted fields (all by default).
+
+        text is the document's joined text; words is an optional WordTable
+        of the same document, needed only by positional rules.
+        """
+        text = text or ""
+        lowered = text.lower()
+        first_seen = {}
+        extracted = {}
+        for field, field_rules in self.rules.items():
+            if fields is not None and field not in fields:
+                continue
+            for rule in field_rules:
+                if "right_of" in rule:
+                    value = self._right_of(rule, words) if words is not None and len(words) else None
+                else:
+                    value = self._search(rule, text, lowered, first_seen)
+                value = re.sub(r"\s+", " ", value).strip() if value else None
+                if value:
+                    extracted[field] = value
+                    break
+        return extracted
+
+
+def merge_rules(*rule_sets):
+    """Concatenate rule sets field by field, earlier sets first."""
+    merged = {}
+    for rules in rule_sets:
+        for field, field_rules in (rules or {}).items():
+            merged.setdefault(field, []).extend(dict(rule) for rule in field_rules)
+    return merged
+
+
+DEFAULT_EXTRACTOR = FieldExtractor(merge_rules(DEFAULT_RULES))
+NAME_EXTRACTOR = FieldExtractor(merge_rules({"name": CANDIDATE_NAME_RULES}))
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import os
+import re
+
+from fastapi import HTTPException
+
+from pipelines.io_utils import FITZ_LOCK, is_pdf, open_pdf
+
+# Largest single certificate accepted
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Largest request body accepted at all (a batch carries many certificates)
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(200 * 1024 * 1024)))
+MAX_PDF_PAGES = int(os.environ.get("MAX_PDF_PAGES", "20"))
+# Uploads up to this size are read into memory; larger ones are read from
+# the file Starlette spools them to (it keeps up to 1 MiB in memory itself)
+SPOOL_MEMORY_BYTES = int(os.environ.get("UPLOAD_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the image formats OpenCV can decode
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"BM", "bmp"),
+)
+
+_LINEARIZED_PAGES_RE = re.compile(rb"/Linearized\b[^>]*?/N\s+(\d+)", re.S)
+
+
+class UploadRejected(Exception):
+    """An upload failed validation; status_code and detail go back to the client."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_kind(head):
+    """File type from the first bytes of a document ("pdf", "png", ...), or None."""
+    if is_pdf(head):
+        return "pdf"
+    for signature, kind in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def sniff_pdf_head(head):
+    """
+    (page count or None, encrypted) from the start of a PDF.
+
+    Linearized files declare their page count up front, and the encryption
+    dictionary is often referenced from the first trailer; anything not
+    visible here is checked once the whole file is in.
+    """
+    match = _LINEARIZED_PAGES_RE.search(head)
+    return (int(match.group(1)) if match else None), b"/Encrypt" in head
+
+
+def _check_pdf(pages, encrypted, max_pages):
+    if encrypted:
+        raise UploadRejected(422, "Encrypted PDFs are not supported.")
+    if pages is not None and pages > max_pages:
+        raise UploadRejected(422, f"PDF has {pages} pages, at most {max_pages} are accepted.")
+
+
+def _inspect_pdf(source):
+    """(page count, encrypted) of a whole PDF, given as bytes or a path."""
+    try:
+        with open_pdf(source) as doc, FITZ_LOCK:
+            return doc.page_count, bool(doc.needs_pass or doc.metadata.get("encryption"))
+    except Exception as e:
+        raise UploadRejected(422, f"Could not read PDF: {e}")
+
+
+class ValidatedUpload:
+    """
+    One validated certificate, with its size and SHA-256.
+
+    A document of up to SPOOL_MEMORY_BYTES is held as bytes. A larger upload
+    stays in the file Starlette already spooled it to and is handed to the
+    pipelines by path, so it is never copied.
+    """
+
+    def __init__(self, filename, kind, size, digest, data=None, file=None):
+        self.filename = filename
+        self.kind = kind
+        self.size = size
+        self._digest = digest
+        self._data = data
+        self._file = file
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def hexdigest(self):
+        return self._digest.hex()
+
+    def source(self):
+        """Bytes of a small upload, or a path to the spool file of a large one (both work as pipeline input)."""
+        if self._data is not None:
+            return self._data
+        return _spool_path(self._file)
+
+    def close(self):
+        # The spool file belongs to the UploadFile; Starlette closes it with the request
+        self._data = None
+        self._file = None
+
+
+def _spool_path(file):
+    """
+    A path pool workers can open the spool file by. The spool is normally an
+    unnamed temporary file, so the path goes through this process's file
+    descriptor table.
+    """
+    name = getattr(file, "name", None)
+    if isinstance(name, str) and os.path.exists(name):
+        return name
+    return f"/proc/{os.getpid()}/fd/{file.fileno()}"
+
+
+def _scan(file, filename, max_bytes, max_pages):
+    """
+    Validate and hash a spooled upload in CHUNK_SIZE pieces; the checks of
+    ingest_upload, run on a worker thread since the spool may be on disk.
+    """
+    file.seek(0)
+    head = file.read(CHUNK_SIZE)
+    if not head:
+        raise UploadRejected(400, f"{filename} is empty.")
+    kind = _check_head(filename, head)
+    if kind == "pdf":
+        _check_pdf(*sniff_pdf_head(head), max_pages)
+
+    h = hashlib.sha256(head)
+    size = len(head)
+    small = bytearray(head)
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadRejected(413, f"{filename} exceeds {max_bytes} bytes.")
+        h.update(chunk)
+        if size <= SPOOL_MEMORY_BYTES:
+            small += chunk
+    file.seek(0)
+
+    if size <= SPOOL_MEMORY_BYTES:
+        upload = ValidatedUpload(filename, kind, size, h.digest(), data=bytes(small))
+    elif os.path.isdir("/proc/self/fd") or isinstance(getattr(file, "name", None), str):
+        upload = ValidatedUpload(filename, kind, size, h.digest(), file=file)
+    else:
+        # No way to name the spool file for another process here
+        upload = ValidatedUpload(filename, kind, size, h.digest(), data=file.read())
+        file.seek(0)
+    if kind == "pdf":
+        # The cross-reference table sits at the end; confirm against the real structure
+        _check_pdf(*_inspect_pdf(upload.source()), max_pages)
+    return upload
+
+
+async def ingest_upload(upload, max_bytes=MAX_UPLOAD_BYTES, max_pages=MAX_PDF_PAGES):
+    """
+    Validate an UploadFile where Starlette spooled it, without copying it.
+
+    The type, and for PDFs the page count and encryption when the header
+    shows them, are checked on the first chunk; the size as chunks are
+    hashed. Raises UploadRejected without reading further on the first
+    violation. The file is read on a worker thread, off the event loop.
+    """
+    if getattr(upload, "size", None) is not None and upload.size > max_bytes:
+        raise UploadRejected(413, f"{upload.filename} exceeds {max_bytes} bytes.")
+    return await asyncio.to_thread(_scan, upload.file, upload.filename, max_bytes, max_pages)
+
+
+def ingest_bytes(data, filename=None, max_bytes=MAX_UPLOAD_BYTES, max_pages=MAX_PDF_PAGES):
+    """
+    The checks of ingest_upload for a document already in memory (e.g. a zip
+    member). Opens PDFs to count their pages, so call it off the event loop.
+    """
+    if len(data) > max_bytes:
+        raise UploadRejected(413, f"{filename} exceeds {max_bytes} bytes.")
+    if not data:
+        raise UploadRejected(400, f"{filename} is empty.")
+    kind = _check_head(filename, data[:CHUNK_SIZE])
+    if kind == "pdf":
+        _check_pdf(*_inspect_pdf(data), max_pages)
+    return ValidatedUpload(filename, kind, len(data), hashlib.sha256(data).digest(), data=data)
+
+
+def _check_head(filename, head):
+    kind = sniff_kind(head)
+    if kind is None:
+        raise UploadRejected(415, f"{filename} is not a PDF or a supported image (PNG, JPEG, TIFF, BMP, WebP).")
+    return kind
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware rejecting request bodies over max_bytes with 413.
+
+    A declared Content-Length is checked before any of the body is read;
+    chunked bodies are counted as they stream in and cut off at the limit,
+    so an oversized upload never finishes spooling.
+    """
+
+    def __init__(self, app, max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            return await _send_too_large(send, self.max_bytes)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI passes HTTPException through body parsing untouched
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {self.max_bytes} bytes.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def _send_too_large(send, max_bytes):
+    body = f'{{"detail":"Request body exceeds {max_bytes} bytes."}}'.encode()
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
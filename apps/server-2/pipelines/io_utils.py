@@ -0,0 +1,95 @@
+import contextlib
+import os
+import threading
+
+# cv2 and numpy are imported where they are used, so the server process can
+# sniff and read uploads without loading them (see pipelines.warmup)
+
+
+class _ForkSafeLock:
+    """
+    Reentrant lock that a forked child gets fresh: a thread holding it at
+    the fork does not exist in the child, which would otherwise wait for
+    it forever.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+    def _reset_after_fork(self):
+        self._lock = threading.RLock()
+
+
+# PyMuPDF is not thread-safe: calls into it from any thread (opening and
+# closing documents, loading pages, reading text, rendering) hold this lock.
+# Stage threads still overlap on OCR, QR decoding and OpenCV work.
+FITZ_LOCK = _ForkSafeLock()
+os.register_at_fork(after_in_child=FITZ_LOCK._reset_after_fork)
+
+
+def read_source(source):
+    """Return the raw bytes of a path, bytes-like object or readable buffer."""
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "read"):
+        data = source.read()
+        return data if isinstance(data, bytes) else bytes(data)
+    raise TypeError(f"Unsupported document source: {type(source).__name__}")
+
+
+def is_pdf(data):
+    """PDF files start with %PDF, though some producers put junk before it."""
+    return b"%PDF" in data[:1024]
+
+
+def decode_image(data):
+    """Decode encoded image bytes (PNG, JPEG, ...) into a BGR ndarray."""
+    import cv2
+    import numpy as np
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image data")
+    return img
+
+
+@contextlib.contextmanager
+def open_pdf(source):
+    """fitz document for PDF bytes or a path, opened and closed under FITZ_LOCK."""
+    import fitz  # PyMuPDF
+
+    with FITZ_LOCK:
+        if isinstance(source, (str, os.PathLike)):
+            doc = fitz.open(source, filetype="pdf")
+        else:
+            doc = fitz.open(stream=source, filetype="pdf")
+    try:
+        yield doc
+    finally:
+        with FITZ_LOCK:
+            doc.close()
+
+
+def pixmap_to_bgr(pix):
+    """Convert a PyMuPDF pixmap to a BGR ndarray without an encode/decode round-trip."""
+    import cv2
+    import numpy as np
+
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    if pix.n == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+    if pix.n == 1:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
@@ -0,0 +1,134 @@
+import glob
+import json
+import os
+import re
+import threading
+
+from pipelines.field_rules import (CANDIDATE_NAME_RULES, DEFAULT_EXTRACTOR, DEFAULT_RULES, NAME_EXTRACTOR,
+                                   FieldExtractor, merge_rules)
+from pipelines.ocr_engine import get_engine
+
+DEFAULT_TEMPLATE_DIR = os.environ.get(
+    "ISSUER_TEMPLATE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "issuer_templates"),
+)
+
+_templates = None
+_templates_lock = threading.Lock()
+
+
+def _compile(template):
+    for spec in template.get("regions", {}).values():
+        if spec.get("validate"):
+            spec["validate_re"] = re.compile(spec["validate"])
+    template["match"] = [m.lower() for m in template.get("match", [])]
+    # The issuer's own text rules go first, the generic ones catch the rest
+    template["extractor"] = FieldExtractor(merge_rules(template.get("rules"), DEFAULT_RULES))
+    name_rules = {"name": (template.get("rules") or {}).get("name", [])}
+    template["name_extractor"] = FieldExtractor(merge_rules(name_rules, {"name": CANDIDATE_NAME_RULES}))
+    return template
+
+
+def load_issuer_templates(template_dir=DEFAULT_TEMPLATE_DIR):
+    """
+    Read every issuer layout (*.json) in template_dir.
+
+    A layout declares field regions as page fractions (x0, y0, x1, y1) so
+    they hold at any render resolution, plus an optional validation regex
+    per field, the phrases that identify the issuer and text extraction
+    rules (see pipelines.field_rules), compiled here once.
+    """
+    templates = {}
+    for path in sorted(glob.glob(os.path.join(template_dir, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            template = _compile(json.load(f))
+        templates[template["id"]] = template
+    return templates
+
+
+def issuer_templates():
+    """All issuer layouts, loaded once per process."""
+    global _templates
+    if _templates is None:
+        with _templates_lock:
+            if _templates is None:
+                _templates = load_issuer_templates()
+    return _templates
+
+
+def get_issuer_template(issuer):
+    """Look up a layout by ID; a layout dict is passed through, None stays None."""
+    if issuer is None or isinstance(issuer, dict):
+        return issuer
+    template = issuer_templates().get(issuer)
+    if template is None:
+        raise ValueError(f"Unknown issuer template: {issuer}")
+    return template
+
+
+def detect_issuer(text):
+    """Return the layout whose identifying phrases all occur in text, if any."""
+    lowered = text.lower()
+    for template in issuer_templates().values():
+        if template["match"] and all(m in lowered for m in template["match"]):
+            return template
+    return None
+
+
+def extractor_for(template=None, text=None):
+    """Field extractor of a layout, of the layout detected from text, or the generic one."""
+    if template is None and text:
+        template = detect_issuer(text)
+    return template["extractor"] if template is not None else DEFAULT_EXTRACTOR
+
+
+def name_extractor_for(template=None, text=None):
+    """Like extractor_for, for the candidate name only: the layout's name rules, then the generic name phrases."""
+    if template is None and text:
+        template = detect_issuer(text)
+    return template["name_extractor"] if template is not None else NAME_EXTRACTOR
+
+
+def region_box(template, field, shape):
+    """Pixel box (x0, y0, x1, y1) of a template field on an image of the given shape."""
+    spec = template.get("regions", {}).get(field)
+    if spec is None:
+        return None
+    h, w = shape[:2]
+    x0, y0, x1, y1 = spec["box"]
+    return (max(int(x0 * w), 0), max(int(y0 * h), 0), min(int(x1 * w), w), min(int(y1 * h), h))
+
+
+def ocr_region(image, template, field):
+    """
+    OCR only the crop of one template field.
+
+    Returns the cleaned text, or None when the region is missing, empty or
+    fails the field's validation regex (callers then fall back to full-page OCR).
+    """
+    box = region_box(template, field, image.shape)
+    spec = template.get("regions", {}).get(field, {})
+    if box is None or not spec.get("ocr", True):
+        return None
+    x0, y0, x1, y1 = box
+    crop = image[y0:y1, x0:x1]
+    if crop.size == 0:
+        return None
+
+    text = re.sub(r"\s+", " ", get_engine().image_to_string(crop)).strip()
+    validate = spec.get("validate_re")
+    if not text or (validate is not None and not validate.match(text)):
+        return None
+    return text
+
+
+def ocr_regions(image, template, fields=None):
+    """OCR every (or the given) OCR-able template field; returns {field: text} for the valid ones."""
+    results = {}
+    for field, spec in template.get("regions", {}).items():
+        if (fields is not None and field not in fields) or not spec.get("ocr", True):
+            continue
+        text = ocr_region(image, template, field)
+        if text is not None:
+            results[field] = text
+    return results
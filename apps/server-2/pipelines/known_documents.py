@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pipelines.io_utils import read_source
+
+DEFAULT_INDEX_PATH = os.environ.get(
+    "KNOWN_DOCUMENTS_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "known_documents.jsonl"),
+)
+
+# Set KNOWN_DOCUMENTS_LOOKUP=0 to analyse every certificate in full
+KNOWN_DOCUMENTS_LOOKUP = os.environ.get("KNOWN_DOCUMENTS_LOOKUP", "1") != "0"
+
+LABELS = ("forged", "original")
+
+
+class KnownDocuments:
+    """
+    Known forgeries and verified originals, looked up by the SHA-256 of the
+    document's bytes and persisted as an append-only file of JSON lines.
+
+    Lookups first read whatever other processes have appended to the file,
+    so all server workers share one index.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self._records = {}
+        self._count = 0
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _refresh(self):
+        """Load records appended to the file since the last read (by this or another process)."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        # A line still being written by another process is picked up next time
+        complete = chunk.rfind(b"\n") + 1
+        for line in chunk[:complete].splitlines():
+            try:
+                record = json.loads(line)
+                sha256 = record["sha256"]
+            except (ValueError, KeyError, TypeError):
+                print(f"Skipping unreadable known-document entry: {line[:80]!r}")
+                continue
+            self._records.setdefault(sha256, []).append(record)
+            self._count += 1
+        self._offset += complete
+
+    def load(self):
+        """Read the index file now rather than on the first lookup."""
+        with self._lock:
+            self._refresh()
+        return self._count
+
+    def add(self, sha256, **fields):
+        """Insert a document's SHA-256 (hex) with its record fields (label, filename, ...); returns the record."""
+        record = dict(fields, sha256=sha256, added_at=time.time())
+        line = f"{json.dumps(record)}\n".encode()
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Single O_APPEND writes keep lines from concurrent processes whole
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._refresh()
+        return record
+
+    def lookup(self, sha256):
+        """Records of the document with this SHA-256 (hex), oldest first."""
+        with self._lock:
+            self._refresh()
+            return list(self._records.get(sha256, ()))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def known_documents():
+    """Process-wide KnownDocuments at KNOWN_DOCUMENTS_PATH."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = KnownDocuments()
+    return _index
+
+
+def index_generation(path=DEFAULT_INDEX_PATH):
+    """
+    Changes whenever any process adds a known document (the index file only
+    grows), so cached results can be keyed on it. Cheap enough to read on
+    every request: the server process does not load the index itself.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _match_report(record):
+    return {
+        "label": record["label"],
+        "filename": record.get("filename"),
+        "sha256": record["sha256"],
+        "added_at": record.get("added_at"),
+    }
+
+
+def find_known(sha256, reference_id=None):
+    """
+    Known forgery, or known original registered against reference_id, with
+    this SHA-256 (hex).
+
+    Returns the analysis result to answer with, carrying a "known_document"
+    entry describing the match, or None.
+    """
+    records = known_documents().lookup(sha256)
+    for record in records:
+        if record.get("label") == "forged":
+            name = record.get("filename") or sha256[:16]
+            result = {
+                "status": "success",
+                "validity_score": 0,
+                "issues": [f"Matches a known forged certificate ({name})."],
+                "extracted_data": {},
+                "forged_areas": [],
+            }
+            break
+    else:
+        originals = [r for r in records if reference_id is not None and r.get("reference_id") == reference_id
+                     and "result" in r]
+        if not originals:
+            return None
+        record = originals[-1]
+        result = dict(record["result"])
+    result["known_document"] = _match_report(record)
+    return result
+
+
+def register_known_document(source, label, filename=None, sha256=None, reference_id=None, result=None):
+    """Add a document to the index as a known forgery or original; returns the record."""
+    if label not in LABELS:
+        raise ValueError(f"label must be one of: {', '.join(LABELS)}")
+    if label == "original" and (reference_id is None or result is None):
+        raise ValueError("A known original needs the reference_id and result it was verified with")
+    if not sha256:
+        sha256 = hashlib.sha256(read_source(source)).hexdigest()
+    fields = {"label": label, "filename": filename}
+    if label == "original":
+        fields.update(reference_id=reference_id, result=result)
+    return known_documents().add(sha256, **fields)
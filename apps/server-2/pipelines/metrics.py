@@ -0,0 +1,171 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Events of the request being traced, if any (see traced_call)
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels=(), value=0.0):
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, row in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), row):
+                    cumulative += count
+                    le = _format_labels(self.labelnames, labels, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                base = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{base} {row[-1]:.6f}")
+                lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("certificate_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+QR_DECODES = Counter("certificate_qr_decodes_total", "QR decode attempts by the method that succeeded.", ["method"])
+OCR_CALLS = Counter("certificate_ocr_calls_total", "Calls into the OCR engine.", ["engine", "call"])
+BYTES_PROCESSED = Counter("certificate_bytes_processed_total", "Document bytes received per endpoint.", ["endpoint"])
+ERRORS = Counter("certificate_errors_total", "Errors raised or reported by a pipeline stage.", ["stage"])
+REQUESTS = Counter("certificate_requests_total", "Verification requests by endpoint and cache status.",
+                   ["endpoint", "cache"])
+TOKEN_VERIFICATIONS = Counter("certificate_token_verifications_total",
+                              "QR token verifications by outcome and verified-token cache status.", ["result", "cache"])
+KNOWN_DOCUMENTS = Counter("certificate_known_document_matches_total",
+                          "Analyses answered from the known-documents index, by the matched record's label.", ["label"])
+
+METRICS = {m.name: m for m in (STAGE_SECONDS, QR_DECODES, OCR_CALLS, BYTES_PROCESSED, ERRORS, REQUESTS,
+                               TOKEN_VERIFICATIONS, KNOWN_DOCUMENTS)}
+
+
+def _record(metric, labels, value):
+    events = _trace.get()
+    if events is not None:
+        # Inside a traced call (usually a pool worker): the caller replays these
+        events.append((metric.name, labels, value))
+    else:
+        apply(metric.name, labels, value)
+
+
+def apply(name, labels, value):
+    metric = METRICS[name]
+    if isinstance(metric, Histogram):
+        metric.observe(labels, value)
+    else:
+        metric.inc(labels, value)
+
+
+def observe_stage(stage, seconds):
+    _record(STAGE_SECONDS, (stage,), seconds)
+
+
+def count(metric, *labels, amount=1):
+    """Increment a counter, e.g. count(OCR_CALLS, "tesserocr", "image_to_data")."""
+    _record(metric, tuple(str(label) for label in labels), amount)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time the enclosed block as stage; an exception also counts as an error of that stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        count(ERRORS, stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def traced_call(fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) and return (result, events).
+
+    Metrics recorded during the call are captured as events instead of
+    updating this process's registry, so a pool worker can hand them back
+    to the server process, which replays them (see replay) and can report
+    them per request (see stage_timings).
+    """
+    events = []
+    token = _trace.set(events)
+    try:
+        return fn(*args, **kwargs), events
+    finally:
+        _trace.reset(token)
+
+
+def replay(events):
+    for name, labels, value in events:
+        apply(name, labels, value)
+
+
+def stage_timings(events):
+    """Total milliseconds per stage in a list of traced events."""
+    timings = {}
+    for name, labels, value in events:
+        if name == STAGE_SECONDS.name:
+            timings[labels[0]] = timings.get(labels[0], 0.0) + value * 1000
+    return {stage: round(ms, 1) for stage, ms in timings.items()}
+
+
+def render_latest(extra=None):
+    """All metrics in the Prometheus text exposition format; extra maps name -> (type, help, value)."""
+    lines = []
+    for metric in METRICS.values():
+        lines.extend(metric.expose())
+    for name, (kind, help, value) in (extra or {}).items():
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,167 @@
+import contextlib
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytesseract
+
+from pipelines import deadline
+from pipelines.metrics import OCR_CALLS, count, timed
+
+try:
+    import tesserocr
+except ImportError:  # optional, see requirements.txt
+    tesserocr = None
+
+# "auto" prefers the in-process tesserocr engine and falls back to pytesseract
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "auto")
+OCR_LANG = os.environ.get("OCR_LANG", "eng")
+
+
+def _to_rgb(image):
+    """OpenCV BGR (or grayscale) ndarray -> contiguous RGB / grayscale ndarray."""
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(image)
+
+
+@contextlib.contextmanager
+def _observed(engine, call):
+    # A request out of time does not start another recognition
+    deadline.check("ocr")
+    count(OCR_CALLS, engine.name, call)
+    with timed("tesseract"):
+        yield
+
+
+@contextlib.contextmanager
+def _time_limited():
+    """Seconds the tesseract process may run (0: no limit); a process killed for running over raises DeadlineExceeded."""
+    left = deadline.remaining()
+    try:
+        yield 0 if left is None else max(left, 0.1)
+    except RuntimeError as e:
+        if "timeout" not in str(e).lower():
+            raise
+        deadline.skip("ocr")
+        raise deadline.DeadlineExceeded("Tesseract was stopped at the request deadline") from e
+
+
+class PytesseractEngine:
+    """Runs the tesseract binary once per call through pytesseract."""
+
+    name = "pytesseract"
+
+    def image_to_string(self, image):
+        with _observed(self, "image_to_string"), _time_limited() as timeout:
+            return pytesseract.image_to_string(_to_rgb(image), lang=OCR_LANG, timeout=timeout)
+
+    def image_to_data(self, image):
+        with _observed(self, "image_to_data"), _time_limited() as timeout:
+            data = pytesseract.image_to_data(_to_rgb(image), lang=OCR_LANG, output_type=pytesseract.Output.DICT,
+                                             timeout=timeout)
+        return {key: data[key] for key in ("text", "conf", "left", "top", "width", "height")}
+
+
+class TesserocrEngine:
+    """
+    Keeps one initialised Tesseract API handle per thread and reuses it.
+
+    Language data is loaded once per handle and pixels are handed over
+    straight from the ndarray, so a call costs only the recognition itself.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._apis = []
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def _set_image(self, image):
+        api = self._api()
+        pixels = _to_rgb(image)
+        height, width = pixels.shape[:2]
+        channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+        api.SetImageBytes(pixels.tobytes(), width, height, channels, width * channels)
+        return api
+
+    def image_to_string(self, image):
+        with _observed(self, "image_to_string"):
+            return self._set_image(image).GetUTF8Text()
+
+    def image_to_data(self, image):
+        with _observed(self, "image_to_data"):
+            api = self._set_image(image)
+            api.Recognize()
+        level = tesserocr.RIL.WORD
+        data = {"text": [], "conf": [], "left": [], "top": [], "width": [], "height": []}
+        for word in tesserocr.iterate_level(api.GetIterator(), level):
+            box = word.BoundingBox(level)
+            if box is None:
+                continue
+            x0, y0, x1, y1 = box
+            data["text"].append(word.GetUTF8Text(level) or "")
+            data["conf"].append(word.Confidence(level))
+            data["left"].append(x0)
+            data["top"].append(y0)
+            data["width"].append(x1 - x0)
+            data["height"].append(y1 - y0)
+        return data
+
+    def close(self):
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis.clear()
+        self._local = threading.local()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _create_engine(kind):
+    if kind in ("auto", "tesserocr") and tesserocr is not None:
+        engine = TesserocrEngine()
+        try:
+            engine._api()  # fail now (e.g. missing tessdata) rather than on the first request
+            return engine
+        except Exception as e:
+            if kind == "tesserocr":
+                raise
+            print(f"tesserocr unavailable ({e}), falling back to pytesseract")
+    elif kind == "tesserocr":
+        raise RuntimeError("OCR_ENGINE=tesserocr but the tesserocr package is not installed")
+    return PytesseractEngine()
+
+
+def get_engine():
+    """Process-wide OCR engine, created on first use according to OCR_ENGINE."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine(OCR_ENGINE)
+    return _engine
+
+
+def _reset_after_fork():
+    # Handles created before a fork belong to the parent; children build their own
+    global _engine
+    _engine = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,20 +1,17 @@
-import cv2
-import pytesseract
+import numpy as np
+from pipelines.io_utils import read_source, decode_image
+from pipelines.ocr_engine import get_engine
+from pipelines.word_table import WordTable
 
-def ocr_with_boxes(image_path):
-    """Perform OCR on an image and return words with bounding boxes."""
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Could not load image: {image_path}")
+def ocr_with_boxes(image):
+    """Perform OCR on an image (ndarray, path, bytes or buffer) and return its words as a WordTable."""
+    img = image if isinstance(image, np.ndarray) else decode_image(read_source(image))
     
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
-    words = []
-    for i, txt in enumerate(data['text']):
-        if txt.strip():
-            words.append({
-                'text': txt.strip(),
-                'conf': float(data['conf'][i]),
-                'bbox': (data['left'][i], data['top'][i],
-                         data['width'][i], data['height'][i])
-            })
-    return words
+    data = get_engine().image_to_data(img)
+    keep = [i for i, txt in enumerate(data['text']) if txt.strip()]
+    return WordTable.from_columns(
+        [data['text'][i].strip() for i in keep],
+        [(data['left'][i], data['top'][i], data['width'][i], data['height'][i]) for i in keep],
+        [float(data['conf'][i]) for i in keep],
+        page_size=(img.shape[1], img.shape[0]),
+    )
@@ -0,0 +1,35 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads shared by the independent stages of one document (QR decode, OCR, ...).
+# pyzbar, OpenCV and Tesseract release the GIL, so these overlap on multi-core hosts.
+STAGE_THREADS = int(os.environ.get("STAGE_THREADS", str(min(4, os.cpu_count() or 1))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide thread pool for running pipeline stages concurrently."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=STAGE_THREADS, thread_name_prefix="stage")
+    return _executor
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn on the stage pool in a copy of the caller's context, so per-request metrics follow it."""
+    return get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _reset_after_fork():
+    # Threads do not survive a fork; let the child start its own pool
+    global _executor
+    _executor = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,27 +1,24 @@
-import os
-import pdfplumber
+from pipelines.document import iter_pages
+from pipelines.metrics import timed
 
-def load_certificate(file_path):
-    """Load PDF or image. For PDF, return extracted words with bounding boxes."""
-    ext = os.path.splitext(file_path)[-1].lower()
-    
-    if ext == ".pdf":
-        with pdfplumber.open(file_path) as pdf:
-            first_page = pdf.pages[0]
-            words = first_page.extract_words()
-            if words:
-                extracted = []
-                for w in words:
-                    extracted.append({
-                        'text': w['text'],
-                        'conf': 99.0,
-                        'bbox': (int(w['x0']), int(w['top']),
-                                 int(w['x1'] - w['x0']), int(w['bottom'] - w['top']))
-                    })
-                return extracted, None
-            img = first_page.to_image(resolution=300).original
-            img_path = file_path.replace(".pdf", "_page.png")
-            img.save(img_path)
-            return None, img_path
-    else:
-        return None, file_path
+def load_certificate(source):
+    """
+    Load a PDF or image from a path, bytes or buffer.
+
+    For a PDF whose text layer passes the quality check (see
+    pipelines.document), return (words, None) with words as a WordTable;
+    nothing is rendered. Otherwise return (None, image) where image is the
+    first page as a BGR ndarray, rendered at the DPI OCR needs.
+    """
+    pages = iter_pages(source)
+    try:
+        pyramid, layer = next(pages)
+        if layer is not None:
+            return layer.words, None
+        if pyramid.page is None:
+            return None, pyramid.for_purpose("ocr")
+        # No usable text layer: rasterise at the DPI OCR needs for this page size
+        with timed("render"):
+            return None, pyramid.for_purpose("ocr")
+    finally:
+        pages.close()
@@ -0,0 +1,175 @@
+import cv2
+import numpy as np
+from pyzbar import pyzbar
+
+from pipelines import deadline
+
+# Longest side of the downscaled copy used to look for finder patterns
+LOCATE_MAX_SIDE = 1000
+# Crops smaller than this (in pixels) are upscaled before decoding
+MIN_DECODE_SIDE = 300
+
+
+def _variant_raw(gray):
+    return gray
+
+
+def _variant_otsu(gray):
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return thresh
+
+
+def _variant_adaptive(gray):
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+
+def _variant_morph(gray):
+    return cv2.morphologyEx(gray, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+
+# Preprocessing variants, cheapest and most likely first
+VARIANTS = [
+    ("raw", _variant_raw),
+    ("otsu", _variant_otsu),
+    ("adaptive", _variant_adaptive),
+    ("morph", _variant_morph),
+]
+# On a whole page only the cheap variants are worth their cost
+FULL_PAGE_VARIANTS = VARIANTS[:2]
+
+
+def _finder_patterns(binary):
+    """
+    Find QR finder patterns: dark squares nested twice (square, ring, square).
+
+    Returns an (N, 3) array of (centre_x, centre_y, side).
+    """
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return np.empty((0, 3))
+    hierarchy = hierarchy[0]
+
+    found = []
+    for i, contour in enumerate(contours):
+        child = hierarchy[i][2]
+        if child < 0 or hierarchy[child][2] < 0:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 7 or h < 7 or not 0.7 <= w / h <= 1.4:
+            continue
+        if cv2.contourArea(contour) < 0.6 * w * h:
+            continue
+        found.append((x + w / 2.0, y + h / 2.0, (w + h) / 2.0))
+    return np.array(found).reshape(-1, 3)
+
+
+def _group_finders(finders):
+    """Group finder patterns that plausibly belong to the same code (union-find)."""
+    parent = list(range(len(finders)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(finders)):
+        for j in range(i + 1, len(finders)):
+            si, sj = finders[i][2], finders[j][2]
+            if not 0.6 <= si / sj <= 1.7:
+                continue
+            # Finder patterns are 7 modules wide; version 40 codes are 177 modules
+            if np.hypot(*(finders[i][:2] - finders[j][:2])) < 26 * max(si, sj):
+                parent[root(i)] = root(j)
+
+    groups = {}
+    for i in range(len(finders)):
+        groups.setdefault(root(i), []).append(i)
+    return [finders[idx] for idx in groups.values()]
+
+
+def locate_qr_regions(gray, max_side=LOCATE_MAX_SIDE):
+    """
+    Cheaply find candidate QR regions on a downscaled copy of the page.
+
+    Returns (x0, y0, x1, y1) boxes in full-resolution pixel coordinates,
+    most promising (most finder patterns) first.
+    """
+    h, w = gray.shape[:2]
+    scale = min(1.0, max_side / float(max(h, w)))
+    small = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+    _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    regions = []
+    for group in _group_finders(_finder_patterns(binary)):
+        side = group[:, 2].max()
+        if len(group) >= 2:
+            pad = side
+            x0, y0 = group[:, 0].min() - side / 2 - pad, group[:, 1].min() - side / 2 - pad
+            x1, y1 = group[:, 0].max() + side / 2 + pad, group[:, 1].max() + side / 2 + pad
+        else:
+            # A lone finder pattern: the code extends away from it in an unknown direction
+            cx, cy = group[0, :2]
+            x0, y0, x1, y1 = cx - 5 * side, cy - 5 * side, cx + 5 * side, cy + 5 * side
+        regions.append((len(group), (x0, y0, x1, y1)))
+
+    regions.sort(key=lambda r: -r[0])
+    boxes = []
+    for _, (x0, y0, x1, y1) in regions:
+        box = (max(int(x0 / scale), 0), max(int(y0 / scale), 0),
+               min(int(np.ceil(x1 / scale)), w), min(int(np.ceil(y1 / scale)), h))
+        if box[2] > box[0] and box[3] > box[1]:
+            boxes.append(box)
+    return boxes
+
+
+def region_from_fractions(shape, fractions, pad=0.02):
+    """Turn a template region given as page fractions (x0, y0, x1, y1) into a pixel box."""
+    h, w = shape[:2]
+    x0, y0, x1, y1 = fractions
+    return (max(int((x0 - pad) * w), 0), max(int((y0 - pad) * h), 0),
+            min(int((x1 + pad) * w), w), min(int((y1 + pad) * h), h))
+
+
+def _decode_variants(gray, variants):
+    for name, variant in variants:
+        codes = pyzbar.decode(variant(gray))
+        if codes:
+            return codes, name
+    return [], None
+
+
+def decode_qr(gray, hint_regions=None, full_page_fallback=True):
+    """
+    Two-stage QR decode: localise first, then run the preprocessing cascade on crops.
+
+    hint_regions are known pixel boxes (e.g. from an issuer template) tried
+    before any detection. Under a request deadline (see pipelines.deadline)
+    the remaining crops are abandoned once it passes, and the whole-page
+    fallback only runs while there is time to spare. Returns (codes, strategy) where strategy names the
+    region source and variant that succeeded, e.g. "finder:otsu", or
+    (codes=[], None) on a miss.
+    """
+    candidates = [("hint", box) for box in (hint_regions or [])]
+    candidates += [("finder", box) for box in locate_qr_regions(gray)]
+
+    for source, (x0, y0, x1, y1) in candidates:
+        if not deadline.allows("qr_regions", cost=0):
+            break
+        crop = gray[y0:y1, x0:x1]
+        if crop.size == 0:
+            continue
+        side = min(crop.shape[:2])
+        if side < MIN_DECODE_SIDE:
+            factor = MIN_DECODE_SIDE / float(side)
+            crop = cv2.resize(crop, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+        codes, variant = _decode_variants(crop, VARIANTS)
+        if codes:
+            return codes, f"{source}:{variant}"
+
+    if full_page_fallback and deadline.allows("qr_full_page"):
+        codes, variant = _decode_variants(gray, FULL_PAGE_VARIANTS)
+        if codes:
+            return codes, f"full:{variant}"
+    return [], None
@@ -0,0 +1,121 @@
+import os
+import threading
+
+import cv2
+import fitz  # PyMuPDF
+
+from pipelines.io_utils import FITZ_LOCK, pixmap_to_bgr
+
+# Resolution each consumer needs, in dots per inch. QR modules survive far
+# coarser renders than small print does under Tesseract.
+PURPOSE_DPI = {
+    "preview": 72,
+    "tamper": 100,
+    "qr": 150,
+    "ocr": 200,
+    "ocr_small": 300,
+}
+# Resolutions tried in turn by a stage that can escalate on a miss
+PURPOSE_LEVELS = {
+    "qr": (150, 300),
+    "ocr": (200, 300),
+}
+# Upper bound on rendered pixels, so oversized pages (posters, A0 scans) stay cheap
+MAX_PIXELS = int(os.environ.get("RENDER_MAX_PIXELS", str(12_000_000)))
+# Decoded images carry no physical size; treat them as scans at this resolution
+IMAGE_NOMINAL_DPI = int(os.environ.get("IMAGE_NOMINAL_DPI", "300"))
+
+
+def choose_dpi(width_pt, height_pt, purpose="ocr", dpi=None):
+    """
+    Pick a render resolution for a page of the given size (PDF points) and use.
+
+    Starts from the purpose's target DPI (or an explicit dpi) and lowers it
+    if the page would exceed MAX_PIXELS.
+    """
+    if dpi is None:
+        dpi = PURPOSE_DPI.get(purpose, PURPOSE_DPI["ocr"])
+    pixels = (width_pt * dpi / 72.0) * (height_pt * dpi / 72.0)
+    if pixels > MAX_PIXELS:
+        dpi = int(dpi * (MAX_PIXELS / pixels) ** 0.5)
+    return max(dpi, 36)
+
+
+def render_page(page, purpose="ocr", dpi=None):
+    """Render a fitz page to a BGR ndarray at the DPI chosen for purpose."""
+    with FITZ_LOCK:
+        if dpi is None:
+            dpi = choose_dpi(page.rect.width, page.rect.height, purpose)
+        zoom = dpi / 72.0
+        return pixmap_to_bgr(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False))
+
+
+class PagePyramid:
+    """
+    Lazily rendered resolutions of one page.
+
+    Built from a fitz page (rendered on demand at each requested DPI) or an
+    already decoded image (downscaled on demand). Coarse stages ask for low
+    resolutions and only escalate when they have to; renders are cached, and
+    a lower resolution is downscaled from a cached higher one rather than
+    rasterised again. Safe to share between threads.
+    """
+
+    def __init__(self, page=None, image=None, image_dpi=IMAGE_NOMINAL_DPI):
+        if (page is None) == (image is None):
+            raise ValueError("PagePyramid needs exactly one of page or image")
+        self.page = page
+        self._levels = {}
+        self._lock = threading.Lock()
+        if image is not None:
+            self.native_dpi = image_dpi
+            self._levels[image_dpi] = image
+            self.width_pt = image.shape[1] * 72.0 / image_dpi
+            self.height_pt = image.shape[0] * 72.0 / image_dpi
+        else:
+            self.native_dpi = None
+            with FITZ_LOCK:
+                self.width_pt, self.height_pt = page.rect.width, page.rect.height
+
+    def _clamp(self, dpi):
+        dpi = choose_dpi(self.width_pt, self.height_pt, dpi=dpi)
+        return min(dpi, self.native_dpi) if self.native_dpi else dpi
+
+    def dpi_for(self, purpose):
+        return self._clamp(PURPOSE_DPI.get(purpose, PURPOSE_DPI["ocr"]))
+
+    def levels_for(self, purpose):
+        """Increasing DPIs a stage with this purpose should try."""
+        wanted = PURPOSE_LEVELS.get(purpose, (PURPOSE_DPI.get(purpose, PURPOSE_DPI["ocr"]),))
+        return sorted({self._clamp(dpi) for dpi in wanted})
+
+    def at_dpi(self, dpi):
+        """The page as a BGR ndarray at (about) the given DPI."""
+        if self.native_dpi:
+            dpi = min(dpi, self.native_dpi)
+        with self._lock:
+            image = self._levels.get(dpi)
+            if image is not None:
+                return image
+
+            higher = [d for d in self._levels if d > dpi]
+            if higher:
+                source_dpi = min(higher)
+                source = self._levels[source_dpi]
+                scale = dpi / float(source_dpi)
+                image = cv2.resize(source, (max(int(source.shape[1] * scale), 1), max(int(source.shape[0] * scale), 1)),
+                                   interpolation=cv2.INTER_AREA)
+            else:
+                image = render_page(self.page, dpi=dpi)
+            self._levels[dpi] = image
+            return image
+
+    def for_purpose(self, purpose):
+        return self.at_dpi(self.dpi_for(purpose))
+
+    def release(self, keep=None):
+        """Drop cached levels except keep (a DPI), to cap memory once a stage is done."""
+        with self._lock:
+            for dpi in list(self._levels):
+                if dpi != keep and dpi != self.native_dpi:
+                    del self._levels[dpi]
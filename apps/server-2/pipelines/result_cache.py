@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from pipelines.lru_cache import LRUCache
+
+# Bump whenever a pipeline change can alter results, so stale entries stop matching
+PIPELINE_VERSION = "8"
+
+DEFAULT_DB_PATH = os.environ.get(
+    "RESULT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "results.sqlite3"),
+)
+DEFAULT_MEMORY_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+DEFAULT_TTL = float(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+DEFAULT_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Expiry and size trimming run once every this many writes
+_EVICT_EVERY = 100
+
+
+def result_key(data, kind, reference_id=None, options=None, digest=None):
+    """
+    Cache key for one verification: document bytes + pipeline version + reference.
+
+    kind separates endpoints (e.g. "analyze", "extract"); options is any
+    extra JSON-serialisable input that changes the result (issuer, flags).
+    digest is the document's SHA-256 when already known, in place of data.
+    """
+    h = hashlib.sha256()
+    h.update(PIPELINE_VERSION.encode())
+    h.update(b"\0" + kind.encode())
+    h.update(b"\0" + (reference_id or "").encode())
+    h.update(b"\0" + json.dumps(options, sort_keys=True).encode())
+    h.update(b"\0" + (digest or hashlib.sha256(data).digest()))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of finished verification results.
+
+    An in-process LRU answers repeat requests without I/O; a local SQLite
+    file keeps results across restarts and between workers. Entries expire
+    after ttl seconds, and the least recently used rows are dropped once the
+    file holds more than max_bytes of results.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, memory_size=DEFAULT_MEMORY_SIZE,
+                 ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._memory = LRUCache(memory_size)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+
+    def _db(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        """Return the cached result for key, or None."""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                return value
+            self._memory.pop(key)
+
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    return None
+                db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Result cache read failed: {e}")
+            return None
+
+        value = json.loads(row[0])
+        self._memory.put(key, (row[1], value))
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serialisable result under key."""
+        now = time.time()
+        expires_at = now + self.ttl
+        payload = json.dumps(value)
+        # Round-trip so memory hits look exactly like SQLite hits (tuples become lists)
+        self._memory.put(key, (expires_at, json.loads(payload)))
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), expires_at, now),
+                )
+                self._writes += 1
+                if self._writes % _EVICT_EVERY == 0:
+                    self._evict(db, now)
+                db.commit()
+        except sqlite3.Error as e:
+            print(f"Result cache write failed: {e}")
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used rows until the total fits again
+        excess = total - self.max_bytes
+        freed = 0
+        doomed = []
+        for key, size in db.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        db.executemany("DELETE FROM results WHERE key = ?", doomed)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -4,5 +4,9 @@ def compute_score(forged_areas):
     issues = []
     if forged_areas:
         score -= len(forged_areas) * 20
-        issues.append("Misaligned fields detected (possible forgery).")
+        tampered = sum(1 for area in forged_areas if area[0] == "tampered_region")
+        if tampered < len(forged_areas):
+            issues.append("Misaligned fields detected (possible forgery).")
+        if tampered:
+            issues.append(f"Pixel-level changes detected in {tampered} region(s) compared to the reference.")
     return max(score, 0), issues
@@ -0,0 +1,252 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from pipelines import deadline
+from pipelines.io_utils import FITZ_LOCK, read_source, is_pdf, decode_image, open_pdf
+from pipelines.rendering import PagePyramid
+
+TAMPER_DETECTION = os.environ.get("TAMPER_DETECTION", "1") != "0"
+# Wall-clock budget for comparing one page, registration included
+TAMPER_BUDGET_MS = float(os.environ.get("TAMPER_BUDGET_MS", "250"))
+# Grey-level differences (0-255) that count a pixel as changed: on the smoothed
+# coarse level (sensitive, so small print is not lost) and at full resolution
+TAMPER_COARSE_DELTA = int(os.environ.get("TAMPER_COARSE_DELTA", "30"))
+TAMPER_PIXEL_DELTA = int(os.environ.get("TAMPER_PIXEL_DELTA", "40"))
+# Fraction of changed pixels that makes a coarse tile suspicious
+TAMPER_TILE_FRACTION = float(os.environ.get("TAMPER_TILE_FRACTION", "0.02"))
+# Side of a coarse tile, in pixels of the coarse level
+TILE_SIZE = 16
+# Changed regions smaller than this many fine-level pixels are ignored
+MIN_REGION_PIXELS = 12
+ORB_FEATURES = 800
+# Registrations supported by fewer matched features fall back to identity
+MIN_INLIERS = 12
+
+_KERNEL = np.ones((3, 3), np.uint8)
+
+
+def _levels(source, dpi_hint=None):
+    """
+    (fine, coarse, dpi): greyscale renders of the first page at the tamper
+    DPI and at half of it.
+
+    With dpi_hint the fine level is resampled to that DPI if the page had to
+    be rendered at another one.
+    """
+    data = read_source(source)
+    if not is_pdf(data):
+        return _grey_levels(PagePyramid(image=decode_image(data)), dpi_hint)
+    with open_pdf(data) as doc:
+        with FITZ_LOCK:
+            page = doc[0]
+        return _grey_levels(PagePyramid(page=page), dpi_hint)
+
+
+def _grey_levels(pyramid, dpi_hint):
+    dpi = pyramid.dpi_for("tamper")
+    fine = cv2.cvtColor(pyramid.at_dpi(dpi), cv2.COLOR_BGR2GRAY)
+    if dpi_hint is not None and dpi != dpi_hint:
+        # Bring the test page to the reference's scale (oversized pages render coarser)
+        scale = dpi_hint / float(dpi)
+        fine = cv2.resize(fine, (max(int(fine.shape[1] * scale), 1), max(int(fine.shape[0] * scale), 1)),
+                          interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        dpi = dpi_hint
+    return fine, cv2.pyrDown(fine), dpi
+
+
+def _features(coarse):
+    keypoints, descriptors = cv2.ORB_create(ORB_FEATURES).detectAndCompute(coarse, None)
+    points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+    return points, descriptors
+
+
+def prepare_reference(source):
+    """
+    Render a reference once for tamper detection.
+
+    Returns the greyscale page at the tamper DPI and the ORB features of its
+    half-resolution level, ready to be stored in a template (the coarse
+    level itself is cheap to rebuild, so it is not kept).
+    """
+    fine, coarse, dpi = _levels(source)
+    points, descriptors = _features(coarse)
+    return {"dpi": dpi, "fine": fine, "points": points, "descriptors": descriptors}
+
+
+def register(reference, coarse):
+    """
+    Affine transform (2x3) mapping a test page's coarse level onto the reference's.
+
+    ORB features are matched and the similarity transform (rotation, uniform
+    scale, shift) is fitted with RANSAC, so changed content does not drag it.
+    Identity if too few features agree.
+    """
+    identity = np.float32([[1, 0, 0], [0, 1, 0]])
+    points, descriptors = _features(coarse)
+    if reference["descriptors"] is None or descriptors is None:
+        return identity
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(reference["descriptors"], descriptors)
+    if len(matches) < MIN_INLIERS:
+        return identity
+    src = reference["points"][[m.queryIdx for m in matches]]
+    dst = points[[m.trainIdx for m in matches]]
+    transform, inliers = cv2.estimateAffinePartial2D(dst, src, method=cv2.RANSAC, ransacReprojThreshold=1.5)
+    if transform is None or int(inliers.sum()) < MIN_INLIERS:
+        return identity
+    return transform.astype(np.float32)
+
+
+def residual(ref, test):
+    """
+    Per-pixel difference that tolerates one pixel of misregistration.
+
+    A pixel only counts as changed if it is darker than the darkest, or
+    lighter than the lightest, pixel in the other image's 3x3 neighbourhood,
+    checked both ways so added and removed ink both show up.
+    """
+    ref16, test16 = ref.astype(np.int16), test.astype(np.int16)
+    diff = np.maximum(test16 - cv2.dilate(ref, _KERNEL), cv2.erode(ref, _KERNEL) - test16)
+    diff = np.maximum(diff, np.maximum(ref16 - cv2.dilate(test, _KERNEL), cv2.erode(test, _KERNEL) - ref16))
+    return np.clip(diff, 0, 255).astype(np.uint8)
+
+
+def tile_scores(changed, tile=TILE_SIZE):
+    """Fraction of changed pixels in each tile x tile block, as a (rows, cols) array."""
+    h, w = (changed.shape[0] // tile) * tile, (changed.shape[1] // tile) * tile
+    return changed[:h, :w].reshape(h // tile, tile, w // tile, tile).mean(axis=(1, 3))
+
+
+def _suspicious_regions(scores, tile):
+    """Groups of adjacent suspicious tiles as (score, (x, y, w, h)) in coarse pixels, worst first."""
+    mask = (scores > TAMPER_TILE_FRACTION).astype(np.uint8)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    regions = []
+    for label in range(1, n):
+        x, y, w, h, _ = stats[label].tolist()
+        score = float(scores[labels == label].sum())
+        regions.append((score, (x * tile, y * tile, w * tile, h * tile)))
+    regions.sort(key=lambda region: region[0], reverse=True)
+    return regions
+
+
+def _refine(ref_fine, test_fine, transform, box, keep):
+    """
+    Changed areas inside one coarse box, re-examined at full resolution, as
+    fine-pixel boxes; pixels where keep is 0 are ignored.
+    """
+    x, y, w, h = (2 * v for v in box)
+    pad = 4
+    x0, y0 = max(x - pad, 0), max(y - pad, 0)
+    x1, y1 = min(x + w + pad, ref_fine.shape[1]), min(y + h + pad, ref_fine.shape[0])
+    # Warp only this window of the test page: shift the transform so the window starts at the origin
+    window = transform.copy()
+    window[:, 2] -= (x0, y0)
+    warped = cv2.warpAffine(test_fine, window, (x1 - x0, y1 - y0), borderValue=255)
+    changed = (residual(ref_fine[y0:y1, x0:x1], warped) > TAMPER_PIXEL_DELTA).astype(np.uint8) & keep[y0:y1, x0:x1]
+    changed = cv2.morphologyEx(changed, cv2.MORPH_CLOSE, _KERNEL)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(changed, connectivity=8)
+    boxes = []
+    for label in range(1, n):
+        bx, by, bw, bh, area = stats[label].tolist()
+        if area >= MIN_REGION_PIXELS:
+            boxes.append((x0 + bx, y0 + by, bw, bh))
+    return _merge_boxes(boxes)
+
+
+def _merge_boxes(boxes, gap=8):
+    """Merge boxes that overlap or lie within gap pixels of each other."""
+    boxes = [list(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                ax, ay, aw, ah = boxes[i]
+                bx, by, bw, bh = boxes[j]
+                if ax - gap <= bx + bw and bx - gap <= ax + aw and ay - gap <= by + bh and by - gap <= ay + ah:
+                    x0, y0 = min(ax, bx), min(ay, by)
+                    boxes[i] = [x0, y0, max(ax + aw, bx + bw) - x0, max(ay + ah, by + bh) - y0]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(b) for b in boxes]
+
+
+def _to_points(box, dpi):
+    scale = 72.0 / dpi
+    return tuple(int(round(v * scale)) for v in box)
+
+
+def _to_test(box, transform):
+    """Bounding box in the test page of a box in the reference frame."""
+    inverse = cv2.invertAffineTransform(transform)
+    x, y, w, h = box
+    corners = np.float32([[x, y], [x + w, y], [x, y + h], [x + w, y + h]])
+    mapped = corners @ inverse[:, :2].T + inverse[:, 2]
+    x0, y0 = mapped.min(axis=0)
+    x1, y1 = mapped.max(axis=0)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def _keep_mask(shape, ignore, pad=2):
+    """uint8 mask of a page level, 0 inside the ignored (x0, y0, x1, y1) page fractions."""
+    keep = np.ones(shape, np.uint8)
+    h, w = shape
+    for x0, y0, x1, y1 in ignore or ():
+        keep[max(int(y0 * h) - pad, 0):int(y1 * h) + pad + 1, max(int(x0 * w) - pad, 0):int(x1 * w) + pad + 1] = 0
+    return keep
+
+
+def detect_tampering(reference, test_source, budget_ms=TAMPER_BUDGET_MS, ignore=None):
+    """
+    Compare a test page pixel by pixel with a reference from prepare_reference.
+
+    The test page is registered onto the reference at half the tamper DPI,
+    where the smoothed difference is summarised per tile with vectorized
+    NumPy. Only groups of tiles with enough changed pixels are warped and
+    compared again at the full tamper DPI with the tolerant residual (see
+    residual), worst first, until budget_ms has been spent. Only refined
+    changes are reported: groups left over when the budget runs out are
+    dropped and "tamper_refinement" is recorded as a skipped check (see
+    pipelines.deadline), so a truncated result is never cached.
+
+    ignore lists (x0, y0, x1, y1) fractions of the reference page whose
+    content may legitimately differ, e.g. another candidate's details on a
+    certificate of the same issuer; they are left out of the comparison.
+    Anything else that differs is reported.
+
+    Returns forged_areas entries ("tampered_region", ref_bbox, test_bbox)
+    with boxes (x, y, w, h) in PDF points of each page.
+    """
+    started = time.perf_counter()
+    dpi = reference["dpi"]
+    test_fine, test_coarse, _ = _levels(test_source, dpi_hint=dpi)
+    ref_coarse = cv2.pyrDown(reference["fine"])
+
+    transform = register(reference, test_coarse)
+    warped = cv2.warpAffine(test_coarse, transform, (ref_coarse.shape[1], ref_coarse.shape[0]), borderValue=255)
+    # Small print is only a few pixels tall here, too thin for the tolerant residual; smoothing
+    # absorbs sub-pixel registration error instead, and the fine pass weeds out the rest
+    diff = cv2.absdiff(cv2.GaussianBlur(ref_coarse, (3, 3), 0), cv2.GaussianBlur(warped, (3, 3), 0))
+    keep = _keep_mask(reference["fine"].shape, ignore)
+    # pyrDown halves rounding up, as does taking every other pixel
+    scores = tile_scores((diff > TAMPER_COARSE_DELTA) & (keep[::2, ::2] > 0))
+
+    # The transform maps coarse test pixels to coarse reference pixels; at the fine level the shift doubles
+    fine_transform = transform.copy()
+    fine_transform[:, 2] *= 2
+
+    areas = []
+    for _, box in _suspicious_regions(scores, TILE_SIZE):
+        if (time.perf_counter() - started) * 1000 >= budget_ms:
+            deadline.skip("tamper_refinement")
+            break
+        for ref_box in _refine(reference["fine"], test_fine, fine_transform, box, keep):
+            test_box = _to_test(ref_box, fine_transform)
+            areas.append(("tampered_region", _to_points(ref_box, dpi), _to_points(test_box, dpi)))
+    return areas
@@ -0,0 +1,22 @@
+# Pipeline entry points the server hands to the worker pool. The server process
+# never runs them itself, so it does not import OpenCV, PyMuPDF or the OCR
+# bindings at start-up; each wrapper imports its pipeline on first call,
+# which in a warmed worker (see pipelines.warmup) has already happened.
+
+
+def analyze_certificate(*args, **kwargs):
+    """See pipelines.analyzer.analyze_certificate."""
+    from pipelines.analyzer import analyze_certificate
+    return analyze_certificate(*args, **kwargs)
+
+
+def extract_identity(*args, **kwargs):
+    """See pipelines.extraction.extract_identity."""
+    from pipelines.extraction import extract_identity
+    return extract_identity(*args, **kwargs)
+
+
+def register_known_document(*args, **kwargs):
+    """See pipelines.known_documents.register_known_document."""
+    from pipelines.known_documents import register_known_document
+    return register_known_document(*args, **kwargs)
@@ -0,0 +1,108 @@
+import os
+import pickle
+import re
+import tempfile
+
+from pipelines.lru_cache import LRUCache
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TEMPLATE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "templates"),
+)
+DEFAULT_CAPACITY = int(os.environ.get("TEMPLATE_CACHE_SIZE", "32"))
+
+_TEMPLATE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_default_store = None
+
+
+def build_template(data, template_id, filename=None):
+    """Run the expensive reference preprocessing and return the template record."""
+    # Runs in pool workers; the server process only stores and looks up templates
+    from pipelines.analyzer import process_document
+    from pipelines.parallel import submit
+    from pipelines.tamper_detection import TAMPER_DETECTION, prepare_reference
+
+    # The render for tamper detection does not need the words; make it alongside them
+    tamper = submit(prepare_reference, data) if TAMPER_DETECTION else None
+    words, extracted_data = process_document(data)
+    return {
+        "id": template_id,
+        "filename": filename or template_id[:12],
+        "words": words,
+        "extracted_data": extracted_data,
+        "tamper": tamper.result() if tamper is not None else None,
+    }
+
+
+def default_store():
+    """
+    This process's TemplateStore. Pool workers load templates through it by
+    ID, from their own LRU or the pickles the server saved, so a request
+    only sends the worker the template ID.
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = TemplateStore()
+    return _default_store
+
+
+class TemplateStore:
+    """
+    Reference certificates, preprocessed once and looked up by content hash.
+
+    Each template holds the reference's word layout and extracted fields,
+    plus its greyscale render for pixel-level tamper detection.
+    Recently used templates live in an in-process LRU; every template is also
+    pickled under cache_dir so it survives restarts and is shared between
+    workers on the same host.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, capacity=DEFAULT_CAPACITY):
+        self.cache_dir = cache_dir
+        self._memory = LRUCache(capacity)
+
+    def add(self, template):
+        """Store a template built by build_template()."""
+        self._memory.put(template["id"], template)
+        self._save(template)
+
+    def get(self, template_id):
+        """Return a registered template, or None if the ID is unknown."""
+        if not _TEMPLATE_ID_RE.match(template_id or ""):
+            return None
+
+        template = self._memory.get(template_id)
+        if template is not None:
+            return template
+
+        template = self._load(template_id)
+        if template is not None:
+            self._memory.put(template_id, template)
+        return template
+
+    def _path(self, template_id):
+        return os.path.join(self.cache_dir, f"{template_id}.pkl")
+
+    def _load(self, template_id):
+        try:
+            with open(self._path(template_id), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable template {template_id}: {e}")
+            return None
+
+    def _save(self, template):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temp file and rename, so concurrent readers never see a partial pickle
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(template, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(template["id"]))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
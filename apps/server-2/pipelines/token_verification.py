@@ -0,0 +1,212 @@
+import difflib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from pipelines.lru_cache import LRUCache
+from pipelines.metrics import TOKEN_VERIFICATIONS, count
+
+try:
+    import jwt
+except ImportError:  # in requirements.txt; without it verification is reported as skipped
+    jwt = None
+
+# Keys the QR tokens are signed with; verification is off unless one is set.
+# JWT_SECRET is the HMAC secret the gateway signs with; JWT_PUBLIC_KEY is PEM
+# text or a path to it; JWT_JWKS is a JWKS URL or a path to a JWKS file.
+JWT_SECRET = os.environ.get("JWT_SECRET")
+JWT_PUBLIC_KEY = os.environ.get("JWT_PUBLIC_KEY")
+JWT_JWKS = os.environ.get("JWT_JWKS")
+JWT_ALGORITHMS = [a.strip() for a in os.environ.get("JWT_ALGORITHMS", "").split(",") if a.strip()]
+JWT_AUDIENCE = os.environ.get("JWT_AUDIENCE") or None
+JWT_ISSUER = os.environ.get("JWT_ISSUER") or None
+# Claim holding the candidate name; dots reach into nested objects ("candidate.name")
+JWT_NAME_CLAIM = os.environ.get("JWT_NAME_CLAIM", "name")
+# Similarity (0-1) from which an OCR name counts as matching the claim
+NAME_MATCH_THRESHOLD = float(os.environ.get("JWT_NAME_MATCH_THRESHOLD", "0.85"))
+VERIFIED_CACHE_SIZE = int(os.environ.get("JWT_CACHE_SIZE", "4096"))
+
+HMAC_ALGORITHMS = ["HS256", "HS384", "HS512"]
+PUBLIC_KEY_ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512", "EdDSA"]
+
+_NON_LETTERS = re.compile(r"[^\w\s]|\d|_")
+
+
+def _read_key(value):
+    """PEM text as given, or the contents of the file it names."""
+    if value and not value.lstrip().startswith("-----") and os.path.isfile(value):
+        with open(value) as f:
+            return f.read()
+    return value
+
+
+def claim_value(claims, path):
+    """Value of a dotted claim path, or None."""
+    value = claims
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _normalise_name(name):
+    return " ".join(_NON_LETTERS.sub(" ", name).casefold().split())
+
+
+def name_similarity(a, b):
+    """
+    0-1 similarity of two person names, ignoring case, punctuation, digits
+    and word order, and tolerant of the odd misread character from OCR.
+    """
+    a, b = _normalise_name(a), _normalise_name(b)
+    if not a or not b:
+        return 0.0
+    in_order = difflib.SequenceMatcher(None, a, b).ratio()
+    sorted_words = difflib.SequenceMatcher(None, " ".join(sorted(a.split())), " ".join(sorted(b.split()))).ratio()
+    return round(max(in_order, sorted_words), 3)
+
+
+class TokenVerifier:
+    """
+    Verifies the JWTs carried in certificate QR codes, in process.
+
+    The key is an HMAC secret, a public key, or a JWKS (URL or file) from
+    which the token's "kid" picks the key. Verified tokens are kept in an
+    LRU keyed by their SHA-256, so a certificate checked again skips the
+    signature check; a cached token is still rejected once its "exp" has
+    passed.
+    """
+
+    def __init__(self, secret=None, public_key=None, jwks=None, algorithms=None, audience=None, issuer=None,
+                 name_claim="name", cache_size=VERIFIED_CACHE_SIZE):
+        self.secret = secret
+        self.public_key = _read_key(public_key)
+        self.audience = audience
+        self.issuer = issuer
+        self.name_claim = name_claim
+        if algorithms:
+            self.algorithms = list(algorithms)
+        else:
+            self.algorithms = HMAC_ALGORITHMS if secret else PUBLIC_KEY_ALGORITHMS
+        self._jwks = jwks
+        self._jwk_client = None
+        self._jwk_set = None
+        self._jwks_lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+
+    @property
+    def enabled(self):
+        return bool(self.secret or self.public_key or self._jwks)
+
+    @property
+    def available(self):
+        """Whether tokens can be verified here (PyJWT is installed)."""
+        return jwt is not None
+
+    def _jwks_key(self, token):
+        kid = jwt.get_unverified_header(token).get("kid")
+        with self._jwks_lock:
+            if self._jwks.startswith(("http://", "https://")):
+                if self._jwk_client is None:
+                    # Fetches the keyset on first use and caches keys by kid
+                    self._jwk_client = jwt.PyJWKClient(self._jwks, cache_keys=True)
+                return self._jwk_client.get_signing_key_from_jwt(token).key
+            if self._jwk_set is None:
+                with open(self._jwks) as f:
+                    self._jwk_set = jwt.PyJWKSet.from_json(f.read())
+        for key in self._jwk_set.keys:
+            if kid is None or key.key_id == kid:
+                return key.key
+        raise jwt.InvalidTokenError(f"No key in the keyset matches kid {kid!r}")
+
+    def _key(self, token):
+        if self._jwks:
+            return self._jwks_key(token)
+        return self.secret or self.public_key
+
+    def verify(self, token):
+        """
+        Return (claims, cached) for a valid token.
+
+        Raises jwt.InvalidTokenError (or a subclass, e.g. ExpiredSignatureError)
+        for a bad one, and RuntimeError if PyJWT is not installed.
+        """
+        if jwt is None:
+            raise RuntimeError("Token verification needs the PyJWT package")
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self._cache.get(digest)
+        if claims is not None:
+            exp = claims.get("exp")
+            if not isinstance(exp, (int, float)) or time.time() < exp:
+                return dict(claims), True
+            self._cache.pop(digest)
+
+        claims = jwt.decode(
+            token,
+            self._key(token),
+            algorithms=self.algorithms,
+            audience=self.audience,
+            issuer=self.issuer,
+            options={"verify_aud": self.audience is not None},
+        )
+        self._cache.put(digest, claims)
+        return dict(claims), False
+
+    def check(self, token, name=None):
+        """
+        Verify a QR token and compare its name claim with a name read from
+        the certificate. Never raises; the report says what failed.
+        """
+        report = {"verified": False, "cached": False, "claims": None, "error": None,
+                  "name_claim": None, "name_match": None, "name_similarity": None}
+        token = (token or "").strip()
+        if not token:
+            report["error"] = "No token was decoded from the certificate."
+            count(TOKEN_VERIFICATIONS, "missing", "none")
+            return report
+        try:
+            claims, cached = self.verify(token)
+        except Exception as e:
+            report["error"] = f"{type(e).__name__}: {e}"
+            count(TOKEN_VERIFICATIONS, "invalid", "miss")
+            return report
+
+        count(TOKEN_VERIFICATIONS, "valid", "hit" if cached else "miss")
+        report.update(verified=True, cached=cached, claims=json.loads(json.dumps(claims, default=str)))
+        claimed_name = claim_value(claims, self.name_claim)
+        if isinstance(claimed_name, str) and claimed_name.strip():
+            report["name_claim"] = claimed_name
+            if name:
+                similarity = name_similarity(claimed_name, name)
+                report["name_similarity"] = similarity
+                report["name_match"] = similarity >= NAME_MATCH_THRESHOLD
+        return report
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """Process-wide TokenVerifier configured from the JWT_* environment variables."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                _verifier = TokenVerifier(
+                    secret=JWT_SECRET,
+                    public_key=JWT_PUBLIC_KEY,
+                    jwks=JWT_JWKS,
+                    algorithms=JWT_ALGORITHMS,
+                    audience=JWT_AUDIENCE,
+                    issuer=JWT_ISSUER,
+                    name_claim=JWT_NAME_CLAIM,
+                )
+                if _verifier.enabled and jwt is None:
+                    print("JWT verification is configured but PyJWT is not installed; token verification is skipped"
+                          " (listed in skipped_checks)")
+    return _verifier
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+# Shared state (imports, compiled layouts) survives a fork; the OCR engine does
+# not (see pipelines.ocr_engine), so each process initialises it itself.
+_state = {"preloaded": False, "warm": False, "seconds": 0.0, "steps": {}}
+_lock = threading.Lock()
+
+
+def _step(name, fn):
+    """Run one warm-up step, recording its duration and any error instead of raising."""
+    started = time.perf_counter()
+    entry = {}
+    try:
+        fn()
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+        print(f"Warm-up step {name} failed: {entry['error']}")
+    elapsed = time.perf_counter() - started
+    entry["ms"] = round(elapsed * 1000, 1)
+    _state["steps"][name] = entry
+    _state["seconds"] = round(_state["seconds"] + elapsed, 3)
+
+
+def _sample_pdf():
+    """A small one-page PDF with a line of text, built in memory."""
+    import fitz  # PyMuPDF
+    from pipelines.io_utils import FITZ_LOCK
+
+    with FITZ_LOCK, fitz.open() as doc:
+        page = doc.new_page(width=288, height=72)
+        page.insert_text((18, 42), "This is to certify that Warm Up has", fontsize=14)
+        return doc.tobytes()
+
+
+def _import_pipeline():
+    import pipelines.analyzer  # noqa: F401
+    import pipelines.extraction  # noqa: F401
+    import pipelines.known_documents  # noqa: F401
+    import pipelines.tamper_detection  # noqa: F401
+
+
+def _compile_issuer_templates():
+    from pipelines.issuer_templates import issuer_templates
+    issuer_templates()
+
+
+def _render_and_decode():
+    import cv2
+    from pipelines.io_utils import FITZ_LOCK, open_pdf
+    from pipelines.preprocessing import load_certificate
+    from pipelines.qr_decoding import decode_qr
+    from pipelines.rendering import PagePyramid
+
+    data = _sample_pdf()
+    load_certificate(data)  # text layer and its quality check
+    with open_pdf(data) as doc:
+        with FITZ_LOCK:
+            page = doc[0]
+        pyramid = PagePyramid(page=page)
+        for purpose in ("qr", "ocr"):
+            image = pyramid.for_purpose(purpose)
+    decode_qr(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), full_page_fallback=False)
+
+
+def _load_known_documents():
+    from pipelines.known_documents import known_documents
+    known_documents().load()
+
+
+def _ocr():
+    from pipelines.io_utils import FITZ_LOCK, open_pdf
+    from pipelines.ocr_engine import get_engine
+    from pipelines.rendering import render_page
+
+    with open_pdf(_sample_pdf()) as doc, FITZ_LOCK:
+        image = render_page(doc[0], purpose="ocr")
+    get_engine().image_to_string(image)
+
+
+def preload():
+    """
+    Import the pipeline, compile issuer layouts, load the index of known
+    documents and push a tiny document through rendering, text extraction
+    and QR decoding.
+
+    Everything done here is inherited by forked processes, so a prefork
+    master or the server process runs it once before its workers start.
+    """
+    with _lock:
+        if _state["preloaded"]:
+            return
+        _step("imports", _import_pipeline)
+        _step("issuer_templates", _compile_issuer_templates)
+        _step("known_documents", _load_known_documents)
+        _step("render", _render_and_decode)
+        _state["preloaded"] = True
+
+
+def warm_up():
+    """
+    Everything the first request would otherwise pay for in this process:
+    preload() plus creating the OCR engine and running it once.
+
+    Used as the analysis pool's worker initializer. Never raises; failed
+    steps are reported by status().
+    """
+    preload()
+    with _lock:
+        if not _state["warm"]:
+            _step("ocr", _ocr)
+            _state["warm"] = True
+    return status()
+
+
+def status():
+    """Warm-up state of this process, as reported by /ready."""
+    return {
+        "preloaded": _state["preloaded"],
+        "pid": os.getpid(),
+        "warm": _state["warm"],
+        "seconds": _state["seconds"],
+        "steps": {name: dict(entry) for name, entry in _state["steps"].items()},
+    }
+
+
+def failed_steps(*states):
+    """Names of the warm-up steps that failed in any of the given status() results."""
+    failed = []
+    for state in states:
+        for name, entry in state["steps"].items():
+            if "error" in entry and name not in failed:
+                failed.append(name)
+    return failed
+
+
+def _reset_after_fork():
+    # The OCR engine is per process; a forked child warms its own
+    global _lock
+    _lock = threading.Lock()
+    _state["warm"] = False
+    _state["steps"].pop("ocr", None)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class WordTable:
+    """
+    Columnar store for the words of one page.
+
+    Instead of one dict per word, positions live in an (N, 4) int32 array of
+    (left, top, width, height) boxes, confidences in a float32 array, and the
+    text as integer codes into a shared vocabulary, so repeated words are
+    stored once. Slicing returns new tables sharing that vocabulary.
+
+    Iterating still yields the old {'text', 'conf', 'bbox'} dicts, so code
+    written against the list-of-dicts format keeps working.
+
+    page_size is the (width, height) of the page in the boxes' units (PDF
+    points for a text layer, pixels for OCR), when known.
+    """
+
+    __slots__ = ("vocab", "codes", "boxes", "conf", "page_size", "_joined")
+
+    def __init__(self, vocab, codes, boxes, conf, page_size=None):
+        self.vocab = vocab
+        self.codes = np.asarray(codes, dtype=np.int32).reshape(-1)
+        self.boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.page_size = page_size
+        self._joined = None
+
+    @classmethod
+    def from_columns(cls, texts, boxes, conf, page_size=None):
+        """Build a table from parallel text / box / confidence sequences."""
+        vocab, index, codes = [], {}, []
+        for text in texts:
+            code = index.get(text)
+            if code is None:
+                code = index[text] = len(vocab)
+                vocab.append(text)
+            codes.append(code)
+        return cls(vocab, codes, boxes, conf, page_size)
+
+    @classmethod
+    def from_records(cls, words):
+        """Build a table from the legacy list of {'text', 'conf', 'bbox'} dicts."""
+        if isinstance(words, WordTable):
+            return words
+        return cls.from_columns(
+            [w['text'] for w in words],
+            [w['bbox'] for w in words],
+            [w.get('conf', 0.0) for w in words],
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], np.empty((0, 4)), [])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return {
+                'text': self.vocab[self.codes[key]],
+                'conf': float(self.conf[key]),
+                'bbox': tuple(int(v) for v in self.boxes[key]),
+            }
+        return self.take(key)
+
+    def __getstate__(self):
+        return (self.vocab, self.codes, self.boxes, self.conf, self.page_size)
+
+    def __setstate__(self, state):
+        # Tables pickled before page_size existed have four fields
+        self.vocab, self.codes, self.boxes, self.conf = state[:4]
+        self.page_size = state[4] if len(state) > 4 else None
+        self._joined = None
+
+    def take(self, selector):
+        """Rows selected by a slice, boolean mask or index array."""
+        return WordTable(self.vocab, self.codes[selector], self.boxes[selector], self.conf[selector], self.page_size)
+
+    @property
+    def texts(self):
+        vocab = self.vocab
+        return [vocab[c] for c in self.codes.tolist()]
+
+    @property
+    def joined_text(self):
+        """All words joined by single spaces, computed once per table."""
+        if self._joined is None:
+            self._joined = " ".join(self.texts)
+        return self._joined
+
+    def encode(self, index, key=str.lower):
+        """
+        Codes of this table's words in a shared index, e.g. to compare two tables.
+
+        index is a dict from key(text) to code that is extended with unseen
+        words; the key function runs once per distinct word, not per row.
+        """
+        mapping = np.array([index.setdefault(key(t), len(index)) for t in self.vocab], dtype=np.int64)
+        return mapping[self.codes] if len(mapping) else np.empty(0, dtype=np.int64)
+
+    @property
+    def centres(self):
+        return self.boxes[:, :2] + self.boxes[:, 2:] / 2.0
+
+    def region(self, x0, y0, x1, y1):
+        """Words whose centre falls inside the rectangle (x0, y0)-(x1, y1)."""
+        c = self.centres
+        mask = (c[:, 0] >= x0) & (c[:, 0] <= x1) & (c[:, 1] >= y0) & (c[:, 1] <= y1)
+        return self.take(mask)
+
+    def filter_conf(self, min_conf):
+        """Words recognised with at least min_conf confidence."""
+        return self.take(self.conf >= min_conf)
@@ -0,0 +1,148 @@
+import asyncio
+import functools
+import math
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+DEFAULT_WORKERS = int(os.environ.get("ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_QUEUE_SIZE = int(os.environ.get("ANALYSIS_QUEUE_SIZE", str(DEFAULT_WORKERS * 2)))
+
+
+def _init_worker(initializer):
+    # Workers are forked from the server and inherit its signal handlers; restore
+    # SIGTERM so they can be stopped, and leave Ctrl+C to the server, which shuts the pool down
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer()
+
+
+class PoolSaturated(Exception):
+    """Raised when the admission queue is full; retry_after is a hint in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Analysis pool is saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AnalysisPool:
+    """
+    Process pool for the CPU-bound certificate pipeline, with bounded admission.
+
+    At most max_workers jobs run at once and at most max_queue more wait for a
+    worker. Anything beyond that is rejected immediately with PoolSaturated
+    instead of piling up behind slow certificates, so the event loop (and
+    health checks) stay responsive.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_QUEUE_SIZE, initializer=None):
+        self.max_workers = max(int(max_workers), 1)
+        self.max_queue = max(int(max_queue), 0)
+        # Run once in every worker process before its first job (e.g. warm-up)
+        self.initializer = initializer
+        self.started = False
+        self._executor = None
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._avg_duration = None
+        self._slots = asyncio.Semaphore(self.capacity)
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_worker, initargs=(self.initializer,)
+            )
+        return self._executor
+
+    async def start(self, probe):
+        """
+        Start every worker now instead of on first use and wait until each
+        has run the initializer. probe is a cheap picklable function run once
+        per worker; returns its results.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        # Workers are spawned per submitted job while none is idle, so this starts all of them
+        results = await asyncio.gather(*(loop.run_in_executor(executor, probe) for _ in range(self.max_workers)))
+        self.started = True
+        return results
+
+    def retry_after(self):
+        """Rough number of seconds until a slot frees up."""
+        avg = self._avg_duration or 1.0
+        waves = (self._in_flight - self.max_workers + 1) / self.max_workers
+        return max(1, math.ceil(avg * max(waves, 1)))
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in a worker process, or raise PoolSaturated."""
+        if self._slots.locked():
+            self._rejected += 1
+            raise PoolSaturated(self.retry_after())
+        await self._slots.acquire()
+        return await self._execute(fn, args, kwargs)
+
+    async def run_queued(self, fn, *args, **kwargs):
+        """
+        Like run(), but wait for a free slot instead of raising PoolSaturated.
+
+        Meant for callers that already bound their own concurrency, such as
+        batch jobs feeding the pool a few items at a time.
+        """
+        await self._slots.acquire()
+        return await self._execute(fn, args, kwargs)
+
+    async def _execute(self, fn, args, kwargs):
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(fn, *args, **kwargs)
+            try:
+                result = await loop.run_in_executor(self._get_executor(), call)
+            except BrokenProcessPool:
+                # A worker died (OOM, segfault in a native library); start a fresh pool
+                self._executor = None
+                raise
+            self._completed += 1
+            return result
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            duration = time.perf_counter() - started
+            if self._avg_duration is None:
+                self._avg_duration = duration
+            else:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def stats(self):
+        running = min(self._in_flight, self.max_workers)
+        return {
+            "workers": self.max_workers,
+            "started": self.started,
+            "max_queue": self.max_queue,
+            "running": running,
+            "queue_depth": self._in_flight - running,
+            "utilisation": round(running / self.max_workers, 3),
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "avg_job_seconds": round(self._avg_duration, 3) if self._avg_duration else None,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            # Wait for the workers to exit; a prefork worker leaves with os._exit, which would orphan them
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -6,16 +6,23 @@ import cv2
 import numpy as np
 from PIL import Image
 import fitz  # PyMuPDF
-import pytesseract
-import re
+from pipelines.document import usable_text_layer
+from pipelines.issuer_templates import name_extractor_for
+from pipelines.ocr_engine import get_engine
+from pipelines.rendering import render_page
 
 # ---------- USER CONFIG ----------
 file_path = r"components\image.png"  # <-- put your file path here
 
 # ---------- PDF to image ----------
-def image_from_pdf_page(pdf_path, page_num=0, zoom=3.0):
-    doc = fitz.open(pdf_path)
+def image_from_pdf_page(doc, page_num=0, zoom=None, purpose="ocr"):
+    # doc is an open fitz.Document (or a path), so callers can open a PDF once for all its pages
+    if not isinstance(doc, fitz.Document):
+        doc = fitz.open(doc)
     page = doc.load_page(page_num)
+    if zoom is None:
+        # Resolution picked from the page size and what the image is for
+        return render_page(page, purpose)
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat, alpha=False)
     mode = "RGB" if pix.n == 3 else "RGBA"
@@ -43,32 +50,33 @@ def to_hex_from_result(data_str):
 # ---------- Text + Name Extraction ----------
 def extract_text(img):
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    text = pytesseract.image_to_string(gray)
+    text = get_engine().image_to_string(gray)
     return text
 
-def extract_name_from_text(text):
-    match = re.search(r"certify that\s+([A-Za-z\s]+)", text, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    return None
+def extract_name_from_text(text, words=None):
+    # words (a text layer's WordTable) also enables the issuer's positional rules
+    return name_extractor_for(text=text).extract(text, words, fields=["name"]).get("name")
 
 # ---------- Main ----------
 def main():
     if not os.path.exists(file_path):
         print("File not found:", file_path); return
 
-    images = []
+    # (image, usable text layer or None) per page; pages with a good text
+    # layer are only rendered at QR resolution and never OCR'd
+    pages = []
     if file_path.lower().endswith(".pdf"):
         doc = fitz.open(file_path)
         for i in range(len(doc)):
-            images.append(image_from_pdf_page(file_path, page_num=i, zoom=3.0))
+            layer = usable_text_layer(doc.load_page(i))
+            pages.append((image_from_pdf_page(doc, page_num=i, purpose="qr" if layer else "ocr"), layer))
     else:
         img = cv2.imread(file_path)
         if img is None:
             print("Failed to open image:", file_path); return
-        images.append(img)
+        pages.append((img, None))
 
-    for page_idx, img in enumerate(images):
+    for page_idx, (img, layer) in enumerate(pages):
         print(f"\n--- Page {page_idx+1} ---")
 
         # QR decoding
@@ -82,8 +90,8 @@ def main():
             print("No QR codes detected on this page.")
 
         # Text + Name extraction
-        text = extract_text(img)
-        name = extract_name_from_text(text)
+        text = layer.text if layer is not None else extract_text(img)
+        name = extract_name_from_text(text, layer.words if layer is not None else None)
         print("\nExtracted text snippet:\n", text[:200], "...\n")  # preview
         if name:
             print("Extracted Name:", name)
@@ -1,149 +1,214 @@
 import cv2
 import numpy as np
-from PIL import Image
-import pytesseract
-import pyzbar
-from pyzbar import pyzbar
-import re
-# import binascii
+import binascii
 import fitz  # PyMuPDF for PDF handling
 import os
-import io
-from pathlib import Path
+from pipelines import deadline
+from pipelines.deadline import DeadlineExceeded
+from pipelines.io_utils import FITZ_LOCK, read_source, is_pdf, decode_image
+from pipelines.document import usable_text_layer
+from pipelines.rendering import PagePyramid
+from pipelines.qr_decoding import decode_qr
+from pipelines.ocr_engine import get_engine
+from pipelines.issuer_templates import get_issuer_template, name_extractor_for, ocr_region, ocr_regions, region_box
+from pipelines.metrics import ERRORS, QR_DECODES, count, timed
+from pipelines.parallel import submit
 
 class CertificateAnalyzer:
-    def __init__(self, file_path):
+    def __init__(self, source, filename=None, issuer=None, text_layer=None):
         """
-        Initialize the certificate analyzer with the path to the certificate file (image or PDF).
+        Initialize the certificate analyzer with a certificate (image or PDF).
         
         Args:
-            file_path (str): Path to the certificate file (supports images and PDFs)
+            source: Path to the certificate file, its raw bytes, a readable
+                buffer, an already decoded BGR image (numpy array), or a
+                PagePyramid of an already opened page
+            filename (str): Optional original file name, used for messages
+            issuer: Optional issuer layout ID (see issuer_templates/) or
+                layout dict; its field regions are OCR'd instead of the
+                whole page when possible
+            text_layer: Optional usable TextLayer of the page (see
+                pipelines.document), for a PagePyramid source; read from the
+                PDF itself otherwise. Names and fields are taken from it
+                instead of OCR, and the page is only rendered for QR decoding
         """
-        self.file_path = file_path
+        self.source = source
+        self.file_path = str(source) if isinstance(source, (str, os.PathLike)) else filename
         self.image = None
+        self.pyramid = None
+        self.text_layer = text_layer
+        self._pdf_document = None
+        if isinstance(source, PagePyramid):
+            self.pyramid = source
+        elif isinstance(source, np.ndarray):
+            self.pyramid = PagePyramid(image=source)
+            self.image = source
         self.candidate_name = None
         self.jwt_token_hex = None
-        self.file_extension = Path(file_path).suffix.lower()
+        self.qr_method = None
+        self.template = get_issuer_template(issuer)
+        self.fields = {}
+        self.name_source = None
     
+    @timed("render")
     def load_image(self):
-        """Load the certificate image from file (supports both images and PDFs)."""
+        """
+        Load the certificate image (supports both images and PDFs).
+        A PDF page with a usable text layer is not rendered here.
+        """
+        if self.image is not None or self.text_layer is not None:
+            return True
+        if self.pyramid is not None:
+            self.image = self.pyramid.for_purpose("ocr")
+            return True
         try:
-            if self.file_extension == '.pdf':
-                return self._load_from_pdf()
+            data = read_source(self.source)
+            if is_pdf(data):
+                return self._load_from_pdf(data)
             else:
-                return self._load_from_image()
+                return self._load_from_image(data)
         except Exception as e:
             print(f"Error loading file: {e}")
+            count(ERRORS, "render")
             return False
     
-    def _load_from_image(self):
-        """Load image from standard image formats (jpg, png, etc.)."""
-        self.image = cv2.imread(self.file_path)
-        if self.image is None:
-            raise ValueError(f"Could not load image from {self.file_path}")
+    def _load_from_image(self, data):
+        """Decode image bytes in a standard image format (jpg, png, etc.)."""
+        self.image = decode_image(data)
+        self.pyramid = PagePyramid(image=self.image)
         return True
     
-    def _load_from_pdf(self):
-        """Load image from PDF file (converts first page to image)."""
+    def _load_from_pdf(self, data):
+        """Render the first page of a PDF held in memory to an image."""
         try:
-            # Open PDF document
-            pdf_document = fitz.open(self.file_path)
-            
-            # Get first page (assuming certificate is on first page)
-            page = pdf_document[0]
-            
-            # Convert page to image (high resolution for better OCR and QR detection)
-            mat = fitz.Matrix(3, 3)  # 3x zoom for better quality
-            pix = page.get_pixmap(matrix=mat)
-            
-            # Convert to PIL Image
-            img_data = pix.tobytes("ppm")
-            pil_image = Image.open(io.BytesIO(img_data))
-            
-            # Convert PIL to OpenCV format
-            opencv_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+            # Open PDF document straight from memory; it stays open (until
+            # close()) so the pyramid can render other resolutions on demand
+            with FITZ_LOCK:
+                self._pdf_document = fitz.open(stream=data, filetype="pdf")
+
+                # Get first page (assuming certificate is on first page)
+                page = self._pdf_document[0]
             
-            self.image = opencv_image
-            pdf_document.close()
+            # Render at the resolution OCR needs for this page size, unless its
+            # text layer can be read instead; QR detection starts coarser and
+            # escalates through the pyramid
+            self.pyramid = PagePyramid(page=page)
+            self.text_layer = usable_text_layer(page)
+            if self.text_layer is None:
+                self.image = self.pyramid.for_purpose("ocr")
             return True
             
         except Exception as e:
             print(f"Error loading PDF: {e}")
+            count(ERRORS, "render")
+            self.close()
             return False
+
+    def close(self):
+        """Close the PDF this analyzer opened, if any; its page cannot be rendered afterwards."""
+        if self._pdf_document is not None:
+            with FITZ_LOCK:
+                self._pdf_document.close()
+            self._pdf_document = None
     
+    @timed("name")
     def extract_candidate_name(self):
         """
         Extract the candidate name from the certificate using OCR.
-        Uses pattern matching similar to your reference code.
+        With an issuer layout, only its name region is OCR'd; the whole page
+        is read (and matched against the layout's or the generic name rules)
+        only when that region is missing or fails validation. A usable text
+        layer is read the same way, without OCR. Under a request deadline the
+        full-page fallback is skipped when time is short.
         """
         try:
-            # Convert image to PIL format for OCR
-            image_rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image_rgb)
+            if self.text_layer is not None:
+                return self._name_from_text_layer()
+
+            if self.template is not None:
+                name = ocr_region(self.image, self.template, "name")
+                if name:
+                    self.candidate_name = name
+                    self.name_source = "template"
+                    print(f"Found candidate name in template region: {self.candidate_name}")
+                    return self.candidate_name
+                if not deadline.allows("name_full_page_ocr"):
+                    print("Template name region failed validation, no time left for full-page OCR")
+                    return None
+                print("Template name region failed validation, falling back to full-page OCR")
             
-            # Extract text using OCR
-            extracted_text = pytesseract.image_to_string(pil_image)
+            # Extract text using OCR (the engine takes the ndarray directly)
+            extracted_text = get_engine().image_to_string(self.image)
             print(f"Extracted text: {extracted_text}")
             
-            # Name extraction patterns based on your reference code
-            name_patterns = [
-                r"This is to certify that\s+([A-Za-z\s]+)\s+has",
-                r"certify that\s+([A-Za-z\s]+)\s+has",
-                r"Name[:\-]?\s*([A-Za-z\s]+)",
-                r"awarded to\s+([A-Za-z\s]+)\s+",
-                r"presented to\s+([A-Za-z\s]+)\s+",
-            ]
-            
-            # Try each pattern to find the name
-            for pattern in name_patterns:
-                match = re.search(pattern, extracted_text, re.IGNORECASE)
-                if match:
-                    name = match.group(1).strip()
-                    # Clean up the name (remove extra spaces and common words)
-                    name = re.sub(r'\s+', ' ', name)  # Replace multiple spaces with single space
-                    self.candidate_name = name
-                    print(f"Found candidate name: {self.candidate_name}")
-                    return self.candidate_name
+            # Name rules of the issuer layout (or the generic ones), precompiled
+            name = name_extractor_for(self.template, extracted_text).extract(extracted_text, fields=["name"]).get("name")
+            if name:
+                self.candidate_name = name
+                self.name_source = "full_page"
+                print(f"Found candidate name: {self.candidate_name}")
+                return self.candidate_name
             
             print("Could not extract candidate name using standard patterns")
             return None
             
+        except DeadlineExceeded as e:
+            print(f"Stopped extracting candidate name: {e}")
+            return None
         except Exception as e:
             print(f"Error extracting candidate name: {e}")
+            count(ERRORS, "name")
             return None
     
+    def _name_from_text_layer(self):
+        layer = self.text_layer
+        name = layer.region_text(self.template, "name") if self.template is not None else None
+        if not name:
+            extractor = name_extractor_for(self.template, layer.text)
+            name = extractor.extract(layer.text, layer.words, fields=["name"]).get("name")
+        if name:
+            self.candidate_name = name
+            self.name_source = "text_layer"
+            print(f"Found candidate name in text layer: {self.candidate_name}")
+            return self.candidate_name
+        print("Could not extract candidate name from the text layer")
+        return None
+
+    @timed("qr")
     def find_and_decode_qr(self):
         """
         Find and decode QR code from the certificate image.
+        Candidate regions are located on a downscaled copy first and the
+        preprocessing cascade only runs on those crops (see
+        pipelines.qr_decoding.decode_qr). Coarse renders of the page are
+        tried before sharper ones, and the issuer template's qr region (if
+        any) is tried before detection. Renders made only for QR decoding
+        are dropped from the pyramid once it is done.
+
+        Sharper levels are skipped when a request deadline is close.
+
         Returns the JWT token in hex format.
         """
         try:
-            # Convert to grayscale for better QR code detection
-            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-            
-            # Try to find QR codes using pyzbar
-            qr_codes = pyzbar.decode(gray)
-            
-            if not qr_codes:
-                print("No QR codes found, trying image preprocessing...")
-                # Try different preprocessing techniques
+            levels = self.pyramid.levels_for("qr") if self.pyramid is not None else [None]
+            qr_codes = []
+            for level, dpi in enumerate(levels):
+                if level and not deadline.allows("qr_high_resolution"):
+                    break
+                image = self.image if dpi is None else self.pyramid.at_dpi(dpi)
                 
-                # Method 1: Gaussian blur and threshold
-                blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-                _, thresh1 = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-                qr_codes = pyzbar.decode(thresh1)
+                # Convert to grayscale for better QR code detection
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
                 
-                if not qr_codes:
-                    # Method 2: Adaptive threshold
-                    thresh2 = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                                   cv2.THRESH_BINARY, 11, 2)
-                    qr_codes = pyzbar.decode(thresh2)
+                box = region_box(self.template, "qr", gray.shape) if self.template is not None else None
+                hints = [box] if box else None
                 
-                if not qr_codes:
-                    # Method 3: Morphological operations
-                    kernel = np.ones((3,3), np.uint8)
-                    morph = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
-                    qr_codes = pyzbar.decode(morph)
+                # Only the last (sharpest) level is worth a whole-page fallback
+                qr_codes, method = decode_qr(gray, hints, full_page_fallback=level == len(levels) - 1)
+                if qr_codes:
+                    self.qr_method = method if dpi is None else f"{method}@{dpi}dpi"
+                    break
+            count(QR_DECODES, self.qr_method or "none")
             
             if qr_codes:
                 for qr_code in qr_codes:
@@ -158,19 +223,51 @@ class CertificateAnalyzer:
                         hex_data = binascii.hexlify(qr_data.encode('utf-8')).decode('utf-8')
                     
                     self.jwt_token_hex = hex_data
-                    print(f"QR Code found and decoded to hex: {hex_data}")
+                    print(f"QR Code found ({self.qr_method}) and decoded to hex: {hex_data}")
                     return hex_data
             else:
                 print("No QR codes could be detected in the image")
                 return None
                 
+        except DeadlineExceeded as e:
+            print(f"Stopped decoding QR code: {e}")
+            return None
         except Exception as e:
             print(f"Error decoding QR code: {e}")
+            count(ERRORS, "qr")
             return None
+        finally:
+            if self.pyramid is not None:
+                # The sharper QR levels are the largest renders; keep only what OCR reads
+                self.pyramid.release(keep=self.pyramid.dpi_for("ocr") if self.image is not None else None)
+    
+    @timed("fields")
+    def extract_template_fields(self):
+        """
+        OCR the issuer layout's other field regions (roll number, DOB, ...).
+        Fields that fail validation are left out. They are read from a usable
+        text layer instead of OCR'd when there is one.
+        """
+        if self.template is None:
+            return self.fields
+        try:
+            fields = [f for f in self.template.get("regions", {}) if f != "name"]
+            if self.text_layer is not None:
+                self.fields = self.text_layer.regions(self.template, fields)
+            else:
+                self.fields = ocr_regions(self.image, self.template, fields)
+        except DeadlineExceeded as e:
+            print(f"Stopped extracting template fields: {e}")
+        except Exception as e:
+            print(f"Error extracting template fields: {e}")
+            count(ERRORS, "fields")
+        return self.fields
     
     def analyze_certificate(self):
         """
         Main method to analyze the certificate - extract name and decode QR code.
+        QR decoding runs on a stage thread (see pipelines.parallel) while
+        this one reads the name and fields; both share the rendered page.
         
         Returns:
             dict: Dictionary containing candidate name and JWT token in hex format
@@ -178,6 +275,9 @@ class CertificateAnalyzer:
         results = {
             'candidate_name': None,
             'jwt_token_hex': None,
+            'qr_method': None,
+            'name_source': None,
+            'fields': {},
             'success': False
         }
         
@@ -185,13 +285,23 @@ class CertificateAnalyzer:
         if not self.load_image():
             return results
         
-        # Extract candidate name
-        self.extract_candidate_name()
-        results['candidate_name'] = self.candidate_name
-        
-        # Find and decode QR code
-        self.find_and_decode_qr()
-        results['jwt_token_hex'] = self.jwt_token_hex
+        # Find and decode QR code, alongside the OCR below
+        qr_future = submit(self.find_and_decode_qr)
+        try:
+            # Extract candidate name
+            self.extract_candidate_name()
+            results['candidate_name'] = self.candidate_name
+            results['name_source'] = self.name_source
+
+            # Fields declared by the issuer layout, if any
+            results['fields'] = self.extract_template_fields()
+
+            deadline.wait(qr_future, "qr")
+            results['jwt_token_hex'] = self.jwt_token_hex
+            results['qr_method'] = self.qr_method
+        finally:
+            # A QR decode cut short by the deadline may still be rendering
+            qr_future.add_done_callback(lambda _: self.close())
         
         # Check if analysis was successful
         if self.candidate_name or self.jwt_token_hex:
@@ -199,17 +309,19 @@ class CertificateAnalyzer:
         
         return results
 
-def analyze_certificate_document(file_path):
+def analyze_certificate_document(source, filename=None, issuer=None):
     """
     Convenience function to analyze a certificate document (image or PDF).
     
     Args:
-        file_path (str): Path to the certificate file (image or PDF)
+        source: Path, bytes or buffer of the certificate file (image or PDF)
+        filename (str): Optional original file name
+        issuer: Optional issuer layout ID for region-based OCR
         
     Returns:
         dict: Analysis results containing candidate name and JWT token hex
     """
-    analyzer = CertificateAnalyzer(file_path)
+    analyzer = CertificateAnalyzer(source, filename, issuer)
     return analyzer.analyze_certificate()
 
 def extract_name_only(image_or_pdf_path):
@@ -218,37 +330,25 @@ def extract_name_only(image_or_pdf_path):
     Based on your reference code pattern.
     
     Args:
-        image_or_pdf_path (str): Path to certificate file
+        image_or_pdf_path: Path, bytes or buffer of the certificate file
         
     Returns:
         str: Extracted candidate name or None if not found
     """
+    analyzer = CertificateAnalyzer(image_or_pdf_path)
     try:
-        analyzer = CertificateAnalyzer(image_or_pdf_path)
         if analyzer.load_image():
-            # Convert image to PIL format for OCR
-            image_rgb = cv2.cvtColor(analyzer.image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image_rgb)
-            
-            # Extract all text
-            text_content = pytesseract.image_to_string(pil_image)
-            
-            # Name extraction patterns (following your reference style)
-            name_patterns = {
-                "certify_pattern": r"This is to certify that\s+([A-Za-z\s]+)\s+has",
-                "name_field": r"Name[:\-]?\s*([A-Za-z\s]+)",
-                "awarded_pattern": r"awarded to\s+([A-Za-z\s]+)",
-            }
+            # Extract all text, from the text layer when the PDF has a usable one
+            if analyzer.text_layer is not None:
+                text_content = analyzer.text_layer.text
+            else:
+                text_content = get_engine().image_to_string(analyzer.image)
             
-            # Try each pattern
-            for pattern_name, pattern in name_patterns.items():
-                match = re.search(pattern, text_content, re.IGNORECASE)
-                if match:
-                    name = match.group(1).strip()
-                    # Clean up name (remove extra spaces)
-                    name = re.sub(r'\s+', ' ', name)
-                    print(f"Name found using {pattern_name}: {name}")
-                    return name
+            # Same precompiled name rules as the full analyzer
+            name = name_extractor_for(text=text_content).extract(text_content, fields=["name"]).get("name")
+            if name:
+                print(f"Name found: {name}")
+                return name
             
             print("No name found with any pattern")
             return None
@@ -256,6 +356,8 @@ def extract_name_only(image_or_pdf_path):
     except Exception as e:
         print(f"Error extracting name: {e}")
         return None
+    finally:
+        analyzer.close()
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import argparse
+import os
+import signal
+import time
+import traceback
+
+import uvicorn
+
+from pipelines import warmup
+
+# Respawning a worker that died sooner than this after starting waits a little, to avoid a crash loop
+MIN_WORKER_LIFETIME = 5.0
+
+
+def _run_worker(config, sock):
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve(app, host="0.0.0.0", port=8000, workers=1):
+    """
+    Serve app with uvicorn, in this process or with `workers` forked workers.
+
+    In prefork mode this process preloads the pipeline (see pipelines.warmup)
+    and binds the listening socket, then forks the workers. They inherit the
+    imported modules and compiled issuer layouts as shared copy-on-write
+    pages instead of each loading its own copy, accept on the same socket,
+    and are replaced if they die. SIGINT/SIGTERM stop them all. Each
+    worker runs its own analysis pool, so size ANALYSIS_WORKERS for the
+    total.
+    """
+    config = uvicorn.Config(app, host=host, port=port)
+    if workers <= 1:
+        uvicorn.Server(config).run()
+        return
+
+    warmup.preload()
+    sock = config.bind_socket()
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(config, sock)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Preloaded in {warmup.status()['seconds']}s, starting {workers} workers on {host}:{port}")
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, starting a new one")
+        if time.monotonic() - started < MIN_WORKER_LIFETIME:
+            time.sleep(1)
+        spawn()
+    sock.close()
+
+
+def main(app, argv=None):
+    parser = argparse.ArgumentParser(description="Run the certificate verification API.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")),
+                        help="server processes forked from a preloaded master (default: 1, no fork)")
+    args = parser.parse_args(argv)
+    serve(app, args.host, args.port, args.workers)
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+
+import pytest
+
+from pipelines.io_utils import FITZ_LOCK, open_pdf
+
+
+def _sample_pdf():
+    fitz = pytest.importorskip("fitz")
+    with fitz.open() as doc:
+        doc.new_page(width=72, height=72)
+        return doc.tobytes()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_child_forked_while_fitz_lock_is_held_can_use_fitz():
+    data = _sample_pdf()
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with FITZ_LOCK:
+            held.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                with open_pdf(data) as doc, FITZ_LOCK:
+                    pages = doc.page_count
+                os._exit(0 if pages == 1 else 1)
+            except BaseException:
+                os._exit(2)
+        deadline = time.monotonic() + 10
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if time.monotonic() > deadline:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                pytest.fail("child forked while FITZ_LOCK was held hung on its first fitz call")
+            time.sleep(0.05)
+        assert os.waitstatus_to_exitcode(status) == 0
+    finally:
+        release.set()
+        holder.join()
+
+
+def test_fitz_lock_is_reentrant():
+    with FITZ_LOCK:
+        with open_pdf(_sample_pdf()) as doc:
+            assert doc.page_count == 1
@@ -0,0 +1,104 @@
+import hashlib
+import os
+
+import pytest
+
+from pipelines import known_documents
+from pipelines.known_documents import KnownDocuments, find_known, register_known_document
+
+COMPONENTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "components")
+ORIGINAL = os.path.join(COMPONENTS, "original", "WBJEE_RESULT.pdf")
+REFERENCE_ID = "a" * 64
+
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_index_is_shared_through_its_file(tmp_path):
+    path = str(tmp_path / "known.jsonl")
+    index = KnownDocuments(path)
+    index.add("1" * 64, label="forged", n=0)
+    index.add("2" * 64, label="forged", n=1)
+    index.add("1" * 64, label="original", n=2)
+
+    # A second instance reads what the first appended, and sees later additions
+    shared = KnownDocuments(path)
+    assert [r["n"] for r in shared.lookup("1" * 64)] == [0, 2]
+    index.add("3" * 64, label="forged", n=3)
+    assert [r["n"] for r in shared.lookup("3" * 64)] == [3]
+    assert shared.lookup("4" * 64) == []
+    assert len(shared) == 4
+
+
+def test_unreadable_and_partial_lines_are_skipped(tmp_path):
+    path = tmp_path / "known.jsonl"
+    path.write_bytes(b'not json\n{"label": "forged"}\n{"sha256": "' + b"1" * 64 + b'", "label": "forged"}\n{"sha')
+    index = KnownDocuments(str(path))
+    assert index.load() == 1
+    assert index.lookup("1" * 64)[0]["label"] == "forged"
+
+
+@pytest.fixture
+def known(tmp_path, monkeypatch):
+    monkeypatch.setattr(known_documents, "_index", KnownDocuments(str(tmp_path / "known.jsonl")))
+    return known_documents._index
+
+
+@pytest.fixture(scope="module")
+def documents():
+    """The genuine WBJEE result and a copy with one digit of the roll number changed."""
+    fitz = pytest.importorskip("fitz")
+    original = open(ORIGINAL, "rb").read()
+    with fitz.open(stream=original, filetype="pdf") as doc:
+        page = doc[0]
+        rect = page.search_for("700064")[0]
+        page.add_redact_annot(rect)
+        page.apply_redactions()
+        page.insert_text(rect.bl + (0, -1.5), "700065", fontname="hebo", fontsize=8)
+        edited = doc.tobytes()
+    return original, edited
+
+
+def test_known_forgery_matches_only_itself(known, documents):
+    original, edited = documents
+    register_known_document(edited, "forged", filename="edited.pdf")
+
+    result = find_known(_sha(edited), REFERENCE_ID)
+    assert result["validity_score"] == 0
+    assert result["known_document"]["filename"] == "edited.pdf"
+    assert result["extracted_data"] == {}
+    assert find_known(_sha(edited)) is not None
+    assert find_known(_sha(original), REFERENCE_ID) is None
+
+
+def test_known_original_matches_only_itself_and_its_reference(known, documents):
+    original, edited = documents
+    verified = {"status": "success", "validity_score": 100, "issues": [],
+                "extracted_data": {"roll": "700064"}, "forged_areas": []}
+    register_known_document(original, "original", reference_id=REFERENCE_ID, result=verified)
+
+    result = find_known(_sha(original), REFERENCE_ID)
+    assert result["validity_score"] == 100
+    assert result["extracted_data"] == {"roll": "700064"}
+    assert result["known_document"]["label"] == "original"
+    # Neither a one-digit edit nor another reference gets the stored result
+    assert find_known(_sha(edited), REFERENCE_ID) is None
+    assert find_known(_sha(original), "b" * 64) is None
+    assert find_known(_sha(original)) is None
+
+
+def test_forgery_outranks_an_original(known, documents):
+    original, _ = documents
+    verified = {"status": "success", "validity_score": 100, "issues": [], "extracted_data": {}, "forged_areas": []}
+    register_known_document(original, "original", reference_id=REFERENCE_ID, result=verified)
+    register_known_document(original, "forged")
+    assert find_known(_sha(original), REFERENCE_ID)["known_document"]["label"] == "forged"
+
+
+def test_original_needs_its_analysis(known, documents):
+    original, _ = documents
+    with pytest.raises(ValueError):
+        register_known_document(original, "original")
+    with pytest.raises(ValueError):
+        register_known_document(original, "counterfeit")
@@ -59,18 +59,21 @@ export default async function verifyCertificateController(req: Request, res: Res
 
         const pythonServiceUrl = process.env.PYTHON_SERVICE_URL || 'http://localhost:5000/extract-data';
 
+        const pythonTimeoutMs = 30000; // 30 second timeout
         const pythonResponse = await axios.post(pythonServiceUrl, formData, {
             headers: {
                 ...formData.getHeaders(),
                 'Content-Type': 'multipart/form-data',
+                // Lets the service skip optional checks rather than run past our timeout
+                'X-Request-Timeout-Ms': String(pythonTimeoutMs),
             },
-            timeout: 30000, // 30 second timeout
+            timeout: pythonTimeoutMs,
         });
 
         console.log('Python service response:', pythonResponse.data);
 
         // Extract name and URL from Python response
-        const { name, token } = pythonResponse.data;
+        const { name, token, verification } = pythonResponse.data;
 
         if (!name || !token) {
             console.log('Incomplete data from Python service:', { name, token });
@@ -82,23 +85,43 @@ export default async function verifyCertificateController(req: Request, res: Res
             return;
         }
 
-        const secret = process.env.JWT_SECRET;
-
-        if (!secret) throw new Error('jwt secret not found');
-
         let payload;
 
-        const isVerified = jwt.verify(token, secret, (err: any, decoded: any) => {
-            if (err) {
+        if (verification) {
+            // The Python service holds the key too and has already verified the token
+            if (!verification.verified) {
                 res.status(400).json({
                     success: false,
                     message: "certificate is forged",
                 });
                 return;
-            } else {
-                payload = decoded;
             }
-        });
+            // A genuine token copied onto a certificate printed for someone else
+            if (verification.name_match === false) {
+                res.status(400).json({
+                    success: false,
+                    message: "certificate is forged: the printed name does not match its QR token",
+                });
+                return;
+            }
+            payload = verification.claims;
+        } else {
+            const secret = process.env.JWT_SECRET;
+
+            if (!secret) throw new Error('jwt secret not found');
+
+            const isVerified = jwt.verify(token, secret, (err: any, decoded: any) => {
+                if (err) {
+                    res.status(400).json({
+                        success: false,
+                        message: "certificate is forged",
+                    });
+                    return;
+                } else {
+                    payload = decoded;
+                }
+            });
+        }
 
         // Log the extracted data for testing
         console.log('Extracted certificate data: ', {